@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import argparse
+import bisect
+import datetime
+import json
+import math
+import time
+import numpy as np
+import iss_tracker
+
+
+
+# A circular orbit at about the altitude and inclination of the ISS
+mu = 398600.4418
+radius = 6778.137
+inclination = math.radians(51.64)
+
+
+
+def orbit(seconds: float) -> tuple:
+    """Gives the exact state vector of the circular orbit.
+
+    Args:
+        seconds: A float number of seconds since the first epoch.
+
+    Returns:
+        A tuple of lists of the X, Y, and Z position in km and velocity in km/s.
+    """
+    n = math.sqrt(mu / radius ** 3)
+    a = n * seconds
+    x, y = radius * math.cos(a), radius * math.sin(a)
+    x_dot, y_dot = -radius * n * math.sin(a), radius * n * math.cos(a)
+    c, s = math.cos(inclination), math.sin(inclination)
+    return [x, y * c, y * s], [x_dot, y_dot * c, y_dot * s]
+
+
+
+def synthetic_oem(n: int, step: int, start: str = '2023-048T12:00:00.000Z') -> dict:
+    """Makes an OEM of the circular orbit, shaped as xmltodict parses the real one.
+
+    Args:
+        n: An integer number of state vectors.
+        step: An integer number of seconds between state vectors.
+        start: A string of the first epoch.
+
+    Returns:
+        A dictionary of the OEM.
+    """
+    t0 = datetime.datetime.strptime(start, '%Y-%jT%H:%M:%S.%fZ')
+    items = []
+    for ii in range(0, n):
+        position, velocity = orbit(ii * step)
+        item = {'EPOCH': (t0 + datetime.timedelta(seconds = ii * step)).strftime('%Y-%jT%H:%M:%S.000Z')}
+        for axis, value in zip(('X', 'Y', 'Z'), position):
+            item[axis] = {'@units': 'km', '#text': f'{value:.6f}'}
+        for axis, value in zip(('X_DOT', 'Y_DOT', 'Z_DOT'), velocity):
+            item[axis] = {'@units': 'km/s', '#text': f'{value:.9f}'}
+        items.append(item)
+    return {'ndm': {'oem': {'body': {'segment': {'data': {'stateVector': items}}}}}}
+
+
+
+def interpolate_naive(epochs: list, position: list, velocity: list, t: list) -> tuple:
+    """Interpolates state vectors one time at a time, in plain Python.
+
+    Each time is placed by a binary search of the epochs with bisect, as
+    hermite() does with searchsorted, so the two differ only in that one
+    loops over the times in Python.
+
+    Args:
+        epochs: A sorted list of datetime.datetime epochs.
+        position: A list of the X, Y, and Z position at each epoch.
+        velocity: A list of the X, Y, and Z velocity at each epoch.
+        t: A list of datetime.datetime times, within the epochs.
+
+    Returns:
+        A tuple of lists of the position and velocity at each time.
+    """
+    interpolated_position, interpolated_velocity = [], []
+    for when in t:
+        ii = min(max(bisect.bisect_right(epochs, when) - 1, 0), len(epochs) - 2)
+        h = (epochs[ii + 1] - epochs[ii]).total_seconds()
+        s = (when - epochs[ii]).total_seconds() / h
+        h00, h10, h01, h11 = 2 * s ** 3 - 3 * s ** 2 + 1, s ** 3 - 2 * s ** 2 + s, -2 * s ** 3 + 3 * s ** 2, s ** 3 - s ** 2
+        d00, d10, d01, d11 = 6 * s ** 2 - 6 * s, 3 * s ** 2 - 4 * s + 1, -6 * s ** 2 + 6 * s, 3 * s ** 2 - 2 * s
+        interpolated_position.append([h00 * position[ii][k] + h10 * h * velocity[ii][k] + \
+                h01 * position[ii + 1][k] + h11 * h * velocity[ii + 1][k] for k in range(0, 3)])
+        interpolated_velocity.append([(d00 * position[ii][k] + d01 * position[ii + 1][k]) / h + \
+                d10 * velocity[ii][k] + d11 * velocity[ii + 1][k] for k in range(0, 3)])
+    return interpolated_position, interpolated_velocity
+
+
+
+def best_of(function, repeats: int) -> float:
+    """Times a function, keeping the fastest of several runs.
+
+    Args:
+        function: A callable taking no arguments.
+        repeats: An integer number of runs.
+
+    Returns:
+        The float fastest time in milliseconds.
+    """
+    samples = []
+    for ii in range(0, repeats):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return min(samples) * 1000
+
+
+
+def run_size(store: iss_tracker.StateVectors, m: int, repeats: int) -> dict:
+    """Interpolates at m random times both ways, then compares them.
+
+    Args:
+        store: A StateVectors of the data set.
+        m: An integer number of query times.
+        repeats: An integer number of runs of each way.
+
+    Returns:
+        A dictionary holding the time taken each way, the largest difference
+        between them, and the largest errors against the exact orbit.
+    """
+    rng = np.random.default_rng(m)
+    span = (store.times[-1] - store.times[0]) / np.timedelta64(1, 'ms')
+    t = store.times[0] + np.sort(rng.integers(0, span, m)).astype('timedelta64[ms]')
+    t_naive = [when.astype(datetime.datetime) for when in t]
+    columns = ([epoch.astype(datetime.datetime) for epoch in store.times], store.position.tolist(), store.velocity.tolist())
+    position, velocity = iss_tracker.hermite(store.times, store.position, store.velocity, t)
+    naive_position, naive_velocity = interpolate_naive(*columns, t_naive)
+    seconds = (t - store.times[0]) / np.timedelta64(1, 's')
+    exact = [orbit(second) for second in seconds]
+    exact_position = np.array([state[0] for state in exact])
+    exact_velocity = np.array([state[1] for state in exact])
+    return {'times': m,
+            'vectorized_ms': best_of(lambda: iss_tracker.hermite(store.times, store.position, store.velocity, t), repeats),
+            'naive_ms': best_of(lambda: interpolate_naive(*columns, t_naive), max(1, repeats // 5)),
+            'max_difference_km': float(np.max(np.abs(position - np.array(naive_position)))),
+            'max_position_error_km': float(np.max(np.linalg.norm(position - exact_position, axis = 1))),
+            'max_velocity_error_km_s': float(np.max(np.linalg.norm(velocity - exact_velocity, axis = 1)))}
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark vectorized against per-point interpolation of ISS state vectors.')
+    parser.add_argument('--sizes', default = '1,100,1000,10000', help = 'comma-separated numbers of query times')
+    parser.add_argument('--epochs', type = int, default = 5400, help = 'number of synthetic state vectors')
+    parser.add_argument('--step', type = int, default = 240, help = 'seconds between synthetic state vectors')
+    parser.add_argument('--repeats', type = int, default = 20, help = 'runs of the vectorized way, the fastest kept')
+    parser.add_argument('--json', action = 'store_true', help = 'print the results as JSON')
+    args = parser.parse_args()
+    store = iss_tracker.StateVectors(synthetic_oem(args.epochs, args.step))
+    results = [run_size(store, int(m), args.repeats) for m in args.sizes.split(',')]
+    if args.json:
+        print(json.dumps(results, indent = 2))
+        return
+    print(f'{args.epochs} epochs, {args.step} s apart')
+    print(f'{"times":>8}{"vectorized ms":>15}{"naive ms":>12}{"speedup":>10}{"max diff km":>14}{"pos err km":>13}{"vel err km/s":>15}')
+    for result in results:
+        speedup = result['naive_ms'] / result['vectorized_ms']
+        print(f'{result["times"]:>8}{result["vectorized_ms"]:>15.3f}{result["naive_ms"]:>12.3f}{speedup:>10.1f}' + \
+                f'{result["max_difference_km"]:>14.1e}{result["max_position_error_km"]:>13.2e}{result["max_velocity_error_km_s"]:>15.2e}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+# Settings for running iss_tracker under gunicorn in production, e.g.
+#     gunicorn -c gunicorn.conf.py iss_tracker:app
+import os
+
+
+
+bind = f'0.0.0.0:{os.environ.get("PORT", 5000)}'
+workers = int(os.environ.get('WEB_WORKERS', 1)) # Processes, each with its own copy of the data, so one keeps every request consistent
+threads = int(os.environ.get('WEB_THREADS', 8)) # Requests each worker handles at once
+worker_class = 'gthread'
+accesslog = '-'
+
+
+
+def post_worker_init(worker):
+    """Starts the first download of a worker after a random delay, so workers do not all download at once."""
+    import iss_tracker
+    iss_tracker.start_loading(iss_tracker.startup_jitter)
@@ -1,12 +1,32 @@
 #!/usr/bin/env python3
 
-from flask import Flask, request
+from flask import Flask, request, Response
 import requests
 import xmltodict
+import numpy as np
+import datetime
+import io
+import csv
+import os
+import random
+import re
+import threading
+import time
 
 
 
 app = Flask(__name__)
+startup_jitter = float(os.environ.get('STARTUP_JITTER', 5)) # Most seconds a worker waits before its first download
+data = None # Raw OEM, only served by /
+store = None # StateVectors of data
+loaded = threading.Event() # Set once the first download finishes, or the data is posted or deleted
+loader = None
+loader_lock = threading.Lock()
+earth_radius = 6378.137 # WGS 84 equatorial radius, km
+earth_flattening = 1 / 298.257223563 # WGS 84
+j2000 = np.datetime64('2000-01-01T12:00:00', 'ms')
+axes = ('X', 'Y', 'Z', 'X_DOT', 'Y_DOT', 'Z_DOT') # Components of a state vector, in the order of the OEM
+plain_time = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?Z?') # ISO 8601 times numpy parses as parse_time() does
 
 
 
@@ -28,6 +48,282 @@ def get_data() -> dict:
 
 
 
+class StateVectors:
+    """A typed, columnar copy of the state vectors of an OEM.
+
+    Built once per data set, so requests index into arrays rather than
+    walking the parsed XML and converting strings to numbers each time. State
+    vectors are kept in time order, and indexed by their EPOCH string.
+
+    Attributes:
+        epochs: A list of the EPOCH strings, exactly as in the OEM.
+        index: A dictionary mapping each EPOCH string to its position.
+        times: A sorted numpy datetime64[ms] array of the epochs, in UTC.
+        position: A numpy (n, 3) float array of X, Y, and Z.
+        velocity: A numpy (n, 3) float array of X_DOT, Y_DOT, and Z_DOT.
+        text: A list of tuples of the X, Y, Z, X_DOT, Y_DOT, and Z_DOT
+            strings of each state vector, exactly as in the OEM.
+        position_units: A string of the units of position, e.g. km.
+        velocity_units: A string of the units of velocity, e.g. km/s.
+    """
+
+    def __init__(self, oem: dict):
+        items = oem['ndm']['oem']['body']['segment']['data']['stateVector']
+        if isinstance(items, dict): # xmltodict gives a lone state vector as a dictionary
+            items = [items]
+        self.epochs = [item['EPOCH'] for item in items]
+        self.text = [tuple(item[axis]['#text'] for axis in axes) for item in items]
+        self.times = np.array([datetime.datetime.strptime(epoch, '%Y-%jT%H:%M:%S.%fZ') for epoch in self.epochs], \
+                dtype = 'datetime64[ms]')
+        self.position = np.array([[float(text) for text in texts[:3]] for texts in self.text], dtype = float).reshape(-1, 3)
+        self.velocity = np.array([[float(text) for text in texts[3:]] for texts in self.text], dtype = float).reshape(-1, 3)
+        self.position_units = items[0]['X']['@units'] if len(items) > 0 else 'km'
+        self.velocity_units = items[0]['X_DOT']['@units'] if len(items) > 0 else 'km/s'
+        order = np.argsort(self.times, kind = 'stable')
+        self.epochs = [self.epochs[ii] for ii in order]
+        self.text = [self.text[ii] for ii in order]
+        self.times, self.position, self.velocity = self.times[order], self.position[order], self.velocity[order]
+        self.index = {epoch: ii for ii, epoch in enumerate(self.epochs)}
+        self.cached_kinematics = None
+
+    def __len__(self) -> int:
+        return len(self.epochs)
+
+    def nearest(self, t: np.datetime64) -> int:
+        """Returns the position of the state vector nearest to time t, by binary search."""
+        ii = int(np.searchsorted(self.times, t))
+        if ii == len(self.times) or (ii > 0 and t - self.times[ii - 1] <= self.times[ii] - t):
+            ii -= 1
+        return ii
+
+    def kinematics(self) -> dict:
+        """Returns the speed, altitude, latitude, and longitude arrays of every epoch, computed once."""
+        if self.cached_kinematics is None:
+            latitude, longitude, altitude = geodetic(self.times, self.position)
+            self.cached_kinematics = {'speed': np.linalg.norm(self.velocity, axis = 1),
+                    'altitude': altitude, 'latitude': latitude, 'longitude': longitude}
+        return self.cached_kinematics
+
+    def state(self, ii: int) -> dict:
+        """Returns state vector ii in the form of the OEM, with its values as written there."""
+        vector = {'EPOCH': self.epochs[ii]}
+        for axis, text in zip(axes, self.text[ii]):
+            vector[axis] = {'@units': self.velocity_units if axis.endswith('_DOT') else self.position_units, '#text': text}
+        return vector
+
+
+
+def geodetic(times: np.ndarray, position: np.ndarray) -> tuple:
+    """Convert inertial positions to geodetic coordinates, all at once.
+
+    Positions in the J2000 frame of the OEM are rotated into the Earth-fixed
+    frame by the Greenwich mean sidereal angle at their epochs, neglecting
+    precession and nutation, then converted to WGS 84 latitude, longitude,
+    and height by a few fixed-point iterations on the latitude.
+
+    Args:
+        times: A numpy datetime64 array of the epochs, in UTC.
+        position: A numpy (n, 3) float array of X, Y, and Z in km.
+
+    Returns:
+        A tuple of numpy arrays of the latitude and longitude in degrees, and
+        the altitude above the ellipsoid in km.
+    """
+    days = (times - j2000) / np.timedelta64(86400, 's')
+    gmst = np.radians((280.46061837 + 360.98564736629 * days) % 360)
+    x = np.cos(gmst) * position[:, 0] + np.sin(gmst) * position[:, 1]
+    y = -np.sin(gmst) * position[:, 0] + np.cos(gmst) * position[:, 1]
+    z = position[:, 2]
+    e2 = earth_flattening * (2 - earth_flattening)
+    p = np.hypot(x, y)
+    latitude = np.arctan2(z, p * (1 - e2))
+    for ii in range(0, 5):
+        n = earth_radius / np.sqrt(1 - e2 * np.sin(latitude) ** 2)
+        latitude = np.arctan2(z + e2 * n * np.sin(latitude), p)
+    altitude = p * np.cos(latitude) + z * np.sin(latitude) - earth_radius * np.sqrt(1 - e2 * np.sin(latitude) ** 2)
+    return np.degrees(latitude), np.degrees(np.arctan2(y, x)), altitude
+
+
+
+def parse_time(t: str) -> np.datetime64:
+    """Parse a time given by the user.
+
+    Args:
+        t: A string of a time in UTC, either in the OEM form
+            YYYY-DDDTHH:MM:SS.000Z or in ISO 8601 form, e.g.
+            YYYY-MM-DDTHH:MM:SSZ, optionally with a UTC offset.
+
+    Returns:
+        A numpy datetime64[ms] of the time.
+
+    Raises:
+        ValueError: If the string is not a time in either form.
+    """
+    try:
+        parsed = datetime.datetime.strptime(t, '%Y-%jT%H:%M:%S.%fZ')
+    except ValueError:
+        parsed = datetime.datetime.fromisoformat(t[:-1] + '+00:00' if t.endswith('Z') else t)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo = None)
+    return np.datetime64(parsed, 'ms')
+
+
+
+def parse_times(ts: list) -> np.ndarray:
+    """Parse many times given by the user.
+
+    Times in ISO 8601 form with a full date and time and no offset, e.g.
+    YYYY-MM-DDTHH:MM:SS.000Z, are parsed together by numpy. Every other
+    string is parsed by parse_time(), since numpy also reads strings it
+    rejects, e.g. now, 2023, or NaT.
+
+    Args:
+        ts: A list of strings of times, in any form parse_time() accepts.
+
+    Returns:
+        A numpy datetime64[ms] array of the times.
+
+    Raises:
+        ValueError: If a string is not a time.
+    """
+    t = np.empty(len(ts), dtype = 'datetime64[ms]')
+    plain = np.array([plain_time.fullmatch(text) is not None for text in ts], dtype = bool)
+    try:
+        t[plain] = np.array([text[:-1] if text.endswith('Z') else text for text, bare in zip(ts, plain) if bare], \
+                dtype = 'datetime64[ms]')
+    except ValueError:
+        t[plain] = [parse_time(text) for text, bare in zip(ts, plain) if bare]
+    t[~plain] = [parse_time(text) for text, bare in zip(ts, plain) if not bare]
+    return t
+
+
+
+def hermite(times: np.ndarray, position: np.ndarray, velocity: np.ndarray, t: np.ndarray) -> tuple:
+    """Interpolate state vectors at many times, all at once.
+
+    Each time is placed between its neighbouring epochs by binary search,
+    and the position is interpolated by the cubic Hermite polynomial matching
+    the position and velocity at both, whose derivative gives the velocity.
+
+    Args:
+        times: A sorted numpy datetime64 array of at least two epochs.
+        position: A numpy (n, 3) float array of the position at each epoch.
+        velocity: A numpy (n, 3) float array of the velocity at each epoch, in
+            position units per second.
+        t: A numpy datetime64 array of the times, within the epochs.
+
+    Returns:
+        A tuple of numpy (m, 3) float arrays of the position and velocity at
+        each time.
+    """
+    ii = np.clip(np.searchsorted(times, t, 'right') - 1, 0, len(times) - 2)
+    h = ((times[ii + 1] - times[ii]) / np.timedelta64(1, 's'))[:, None]
+    s = ((t - times[ii]) / np.timedelta64(1, 's'))[:, None] / h
+    p0, p1, v0, v1 = position[ii], position[ii + 1], velocity[ii] * h, velocity[ii + 1] * h
+    s2, s3 = s * s, s * s * s
+    interpolated_position = (2 * s3 - 3 * s2 + 1) * p0 + (s3 - 2 * s2 + s) * v0 + (-2 * s3 + 3 * s2) * p1 + (s3 - s2) * v1
+    interpolated_velocity = ((6 * s2 - 6 * s) * p0 + (3 * s2 - 4 * s + 1) * v0 + (-6 * s2 + 6 * s) * p1 + (3 * s2 - 2 * s) * v1) / h
+    return interpolated_position, interpolated_velocity
+
+
+
+def nearest_state(t: np.datetime64) -> dict:
+    """Get the state vector nearest to a time.
+
+    Args:
+        t: A numpy datetime64 of the desired time.
+
+    Returns:
+        A dictionary holding the requested time t, the signed offset_seconds
+        from it to the nearest epoch, and the state_vector of that epoch.
+    """
+    global store
+    ii = store.nearest(t)
+    return {'t': str(t) + 'Z',
+            'offset_seconds': float((store.times[ii] - t) / np.timedelta64(1, 's')),
+            'state_vector': store.state(ii)}
+
+
+
+def set_data(new_data: dict) -> None:
+    """Replace the data set.
+
+    Args:
+        new_data: A dictionary of the OEM as returned by get_data(), or None
+            to clear the data set.
+
+    Returns:
+        None
+    """
+    global data, store
+    new_store = StateVectors(new_data) if new_data is not None else None
+    data, store = new_data, new_store
+
+
+
+def load_data(jitter: float = 0) -> None:
+    """Get the data for the first time.
+
+    This function waits a random time of up to jitter seconds, so that
+    workers started together do not all download the data at once, then
+    calls get_data(), retrying with a growing delay until it succeeds. If the
+    data is posted or deleted in the meantime, that is kept instead.
+
+    Args:
+        jitter: The most seconds to wait before the first download.
+
+    Returns:
+        None
+    """
+    time.sleep(random.uniform(0, jitter))
+    delay = 1
+    while not loaded.is_set():
+        try:
+            new_data = get_data()
+            if not loaded.is_set():
+                set_data(new_data)
+                loaded.set()
+        except Exception as e:
+            print(f'ERROR: unable to get data, retrying in {delay} s\n{e}')
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+
+def start_loading(jitter: float = 0) -> None:
+    """Start getting the data in the background, once per process.
+
+    Args:
+        jitter: The most seconds to wait before the first download.
+
+    Returns:
+        None
+    """
+    global loader
+    with loader_lock:
+        if loader is None:
+            loader = threading.Thread(target = load_data, args = (jitter,), daemon = True)
+            loader.start()
+
+
+
+@app.before_request
+def wait_for_data():
+    """Hold off requests for data until the first download finishes.
+
+    Args:
+        None
+
+    Returns:
+        None if the request may proceed. Otherwise, a descriptive string with
+        a 503 status code.
+    """
+    start_loading()
+    if not loaded.is_set() and request.endpoint not in ('ready', 'help', 'delete_data', 'post_data'):
+        return f'Data is still loading\n', 503
+
+
+
 @app.route('/', methods = ['GET'])
 def all() -> dict:
     """ Get all data.
@@ -65,27 +361,153 @@ def epochs() -> list:
             If there is an error, a descriptive string will be returned with
             a 404 status code.
     """
-    global data
-    if data == None:
+    global store
+    if store == None:
         return f'Empty data set\n', 404
-    limit = request.args.get('limit', len(data['ndm']['oem']['body']['segment']['data']['stateVector']))
+    limit = request.args.get('limit', len(store))
     offset = request.args.get('offset', 0)
     try:
         limit = int(limit)
         offset = int(offset)
     except:
         return f'Parameters limit and offset must be integers\n', 404
-    epochs = []
-    i = 0
-    count = 0
-    for stateVector in data['ndm']['oem']['body']['segment']['data']['stateVector']:
-        if count >= limit:
-            break
-        elif i >= offset:
-            epochs.append(stateVector['EPOCH'])
-            count += 1
-        i += 1
-    return epochs
+    offset = max(offset, 0)
+    return store.epochs[offset:offset + max(limit, 0)]
+
+
+
+@app.route('/epochs/nearest', methods = ['GET'])
+def epochs_nearest() -> dict:
+    """Get the state vector nearest to a time.
+
+    This function takes in the parameter t, a time which need not match any
+    epoch exactly, and finds the nearest epoch by binary search over the
+    sorted epochs.
+
+    Args:
+        None
+
+    Returns:
+        A dictionary holding the requested time t, the signed offset_seconds
+        from it to the nearest epoch, and the state_vector of that epoch. If
+        there is an error, a descriptive string will be returned with a 404
+        status code.
+    """
+    global store
+    if store == None or len(store) == 0:
+        return f'Empty data set\n', 404
+    try:
+        t = parse_time(request.args['t'])
+    except (KeyError, ValueError):
+        return f'Parameter t must be a time, e.g. 2023-048T12:00:00.000Z or 2023-02-17T12:00:00Z\n', 404
+    return nearest_state(t)
+
+
+
+@app.route('/now', methods = ['GET'])
+def now() -> dict:
+    """Get the state vector nearest to the current time.
+
+    Args:
+        None
+
+    Returns:
+        A dictionary holding the current time t, the signed offset_seconds
+        from it to the nearest epoch, and the state_vector of that epoch. If
+        there is an error, a descriptive string will be returned with a 404
+        status code.
+    """
+    global store
+    if store == None or len(store) == 0:
+        return f'Empty data set\n', 404
+    return nearest_state(np.datetime64(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo = None), 'ms'))
+
+
+
+@app.route('/kinematics', methods = ['GET'])
+def kinematics():
+    """Get the speed, altitude, and position over the Earth of many epochs.
+
+    This function returns the speed, altitude, geodetic latitude, and
+    longitude at every epoch, computed for the whole data set in one
+    vectorized pass and kept until the data set changes. The optional
+    parameters start and end restrict the epochs to a time range, and limit
+    and offset page through them. The optional parameter format chooses
+    columnar JSON, the default, or CSV.
+
+    Args:
+        None
+
+    Returns:
+        If format is json, a dictionary holding the units, and a list for the
+            epochs and for each quantity, in order of time. If format is csv,
+            the same as CSV text with a header row. If there is an error, a
+            descriptive string will be returned with a 404 status code.
+    """
+    global store
+    if store == None:
+        return f'Empty data set\n', 404
+    try:
+        first = int(np.searchsorted(store.times, parse_time(request.args['start']), 'left')) if 'start' in request.args else 0
+        last = int(np.searchsorted(store.times, parse_time(request.args['end']), 'right')) if 'end' in request.args else len(store)
+    except ValueError:
+        return f'Parameters start and end must be times, e.g. 2023-048T12:00:00.000Z or 2023-02-17T12:00:00Z\n', 404
+    try:
+        limit = int(request.args.get('limit', len(store)))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return f'Parameters limit and offset must be integers\n', 404
+    the_format = request.args.get('format', 'json')
+    if the_format not in ('json', 'csv'):
+        return f'Parameter format must be json or csv\n', 404
+    first = min(first + max(offset, 0), last)
+    last = min(first + max(limit, 0), last)
+    columns = {name: values[first:last].tolist() for name, values in store.kinematics().items()}
+    units = {'speed': store.velocity_units, 'altitude': store.position_units, 'latitude': 'deg', 'longitude': 'deg'}
+    if the_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['epoch'] + [f'{name} ({units[name]})' for name in columns])
+        writer.writerows(zip(store.epochs[first:last], *columns.values()))
+        return Response(buffer.getvalue(), mimetype = 'text/csv')
+    return {'units': units, 'epochs': store.epochs[first:last], **columns}
+
+
+
+@app.route('/interpolate', methods = ['GET', 'POST'])
+def interpolate() -> dict:
+    """Get the position and velocity at arbitrary times.
+
+    This function takes in one or many times, as repeated t parameters or,
+    with POST, as a JSON list, and interpolates the state vector at each from
+    the neighbouring epochs with hermite(), all in one vectorized pass.
+
+    Args:
+        None
+
+    Returns:
+        A dictionary holding the units, and a list of the times and of each
+        component of the position and velocity, in the order of the times. If
+        there is an error, or a time falls outside the data set, a
+        descriptive string will be returned with a 404 status code.
+    """
+    global store
+    if store == None or len(store) < 2:
+        return f'Empty data set\n', 404
+    ts = request.get_json(silent = True) if request.method == 'POST' else request.args.getlist('t')
+    if not isinstance(ts, list) or len(ts) == 0 or any(not isinstance(t, str) for t in ts):
+        return f'Times must be given as t parameters, or POSTed as a JSON list of strings\n', 404
+    try:
+        t = parse_times(ts)
+    except ValueError:
+        return f'Times must be e.g. 2023-048T12:00:00.000Z or 2023-02-17T12:00:00Z\n', 404
+    if np.any(t < store.times[0]) or np.any(t > store.times[-1]):
+        return f'Times must be between {store.epochs[0]} and {store.epochs[-1]}\n', 404
+    position, velocity = hermite(store.times, store.position, store.velocity, t)
+    return {'units': {'position': store.position_units, 'velocity': store.velocity_units},
+            't': [f'{when}Z' for when in t],
+            'x': position[:, 0].tolist(), 'y': position[:, 1].tolist(), 'z': position[:, 2].tolist(),
+            'x_dot': velocity[:, 0].tolist(), 'y_dot': velocity[:, 1].tolist(), 'z_dot': velocity[:, 2].tolist()}
 
 
 
@@ -95,7 +517,8 @@ def epochs_state(epoch: str) -> dict:
 
     This function takes in a string representing the desired epoch. If an
     exact match is found in the data set, its state vector is returned.
-    Otherwise, the user is given a 404 error.
+    Otherwise, the user is given a 404 error. The epoch is looked up in a
+    dictionary, so this takes constant time.
 
     Args:
         String representing the desired epoch.
@@ -108,14 +531,12 @@ def epochs_state(epoch: str) -> dict:
         Y_DOT, and X_DOT. If there is an error, a descriptive string will be
         returned with a 404 status code.
     """
-    global data
-    if data == None:
+    global store
+    if store == None:
         return f'Empty data set\n', 404
-    for item in data['ndm']['oem']['body']['segment']['data']['stateVector']:
-        if item['EPOCH'] == epoch:
-            return item
-    else: # No matching epoch
+    if epoch not in store.index: # No matching epoch
         return f'Epoch {epoch} not found\n', 404
+    return store.state(store.index[epoch])
 
 
 
@@ -141,17 +562,13 @@ def epochs_speed(epoch: str) -> dict:
         If there is an error, a descriptive string will be
         returned with a 404 status code.
     """
-    global data
-    if data == None:
+    global store
+    if store == None:
         return f'Empty data set\n', 404
-    for item in data['ndm']['oem']['body']['segment']['data']['stateVector']:
-        if item['EPOCH'] == epoch:
-            return {'speed' : (float(item['X_DOT']['#text']) ** 2 + \
-                    float(item['Y_DOT']['#text']) ** 2 + \
-                    float(item['Z_DOT']['#text']) ** 2) ** 0.5, \
-                    'units' : item['X_DOT']['@units']}
-    else: # No matching epoch
+    if epoch not in store.index: # No matching epoch
         return f'Epoch {epoch} not found\n', 404
+    return {'speed' : float(np.linalg.norm(store.velocity[store.index[epoch]])), \
+            'units' : store.velocity_units}
 
 
 
@@ -167,8 +584,8 @@ def delete_data() -> str:
     Returns:
         A string confurming that the data has been deleted.
     """
-    global data
-    data = None
+    set_data(None)
+    loaded.set()
     return 'Data deleted from instance\n'
 
 @app.route('/post-data', methods = ['POST'])
@@ -187,12 +604,29 @@ def post_data() -> None:
     Returns:
         A string confirming that the data has been refreshed.
     """
-    global data
-    data = get_data()
+    set_data(get_data())
+    loaded.set()
     return 'Data refreshed\n'
 
 
 
+@app.route('/ready', methods = ['GET'])
+def ready() -> str:
+    """Report whether this worker can serve data.
+
+    Args:
+        None
+
+    Returns:
+        A string saying the worker is ready, or that it is still loading data
+        with a 503 status code, for use as a readiness probe.
+    """
+    if not loaded.is_set():
+        return f'Loading data\n', 503
+    return 'Ready\n'
+
+
+
 @app.route('/help', methods = ['GET'])
 def help() -> str:
     """Returns help description detailing API endpoints.
@@ -217,13 +651,30 @@ def help() -> str:
             '\t/epochs/<int:epoch>/speed GET Return the instantaneous\n' + \
             '\t\tspeed for an epoch in JSON form. Returns a string\n' + \
             '\t\terror message with a 404 status if no such record.\n' + \
+            '\t/epochs/nearest GET Return the state vector nearest\n' + \
+            '\t\tto a time in JSON form.\n' + \
+            '\t\tstr:t The time, e.g. 2023-02-17T12:00:00Z\n' + \
+            '\t/now GET Return the state vector nearest to the\n' + \
+            '\t\tcurrent time in JSON form.\n' + \
+            '\t/kinematics GET Return the speed, altitude, latitude,\n' + \
+            '\t\tand longitude of every epoch, in columns.\n' + \
+            '\t\tstr:start The earliest time to include.\n' + \
+            '\t\tstr:end The latest time to include.\n' + \
+            '\t\tint:limit The maximum number of epochs to return.\n' + \
+            '\t\tint:offset What epoch to start from, zero-indexed\n' + \
+            '\t\tstr:format json, the default, or csv.\n' + \
+            '\t/interpolate GET, POST Return the position and velocity\n' + \
+            '\t\tat any times within the data set, in columns.\n' + \
+            '\t\tstr:t A time, repeated for each, or POST them\n' + \
+            '\t\tas a JSON list.\n' + \
             '\t/delete-data DETETE Clear all data in the instance.\n' + \
-            '\t/post-data POST Update and overwrite all data.\n'
-
+            '\t/post-data POST Update and overwrite all data.\n' + \
+            '\t/ready GET Return whether the data has loaded, or\n' + \
+            '\t\ta string message with a 503 status if not.\n'
 
 
 
-data = get_data() # No matter how the app is started, we need to get data
 
 if __name__ == '__main__':
+    start_loading() # Under gunicorn, each worker starts loading from gunicorn.conf.py instead
     app.run(debug = True, host = '0.0.0.0') # If interpreted in Python, ensures app is run
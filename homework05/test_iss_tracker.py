@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+
+
+from iss_tracker import StateVectors, geodetic, hermite, parse_times, earth_radius, earth_flattening, j2000
+import numpy as np
+import pytest
+
+
+
+def circular_orbit(seconds):
+    # A circular orbit of radius r, inclined by i, with mean motion n
+    r, i, n = 6778.137, np.radians(51.64), np.sqrt(398600.4418 / 6778.137 ** 3)
+    a = n * seconds
+    position = np.stack([r * np.cos(a), r * np.sin(a) * np.cos(i), r * np.sin(a) * np.sin(i)], axis = 1)
+    velocity = np.stack([-r * n * np.sin(a), r * n * np.cos(a) * np.cos(i), r * n * np.cos(a) * np.sin(i)], axis = 1)
+    return position, velocity
+
+
+
+def test_hermite():
+    seconds = np.arange(0, 240 * 30, 240)
+    times = j2000 + (seconds * 1000).astype('timedelta64[ms]')
+    position, velocity = circular_orbit(seconds.astype(float))
+    # Exact at the epochs, including the last
+    at_position, at_velocity = hermite(times, position, velocity, times)
+    assert np.allclose(at_position, position, rtol = 0, atol = 1e-9)
+    assert np.allclose(at_velocity, velocity, rtol = 0, atol = 1e-12)
+    # Close to the orbit between them, in any order
+    between = np.array([6900.5, 60, 3599.9, 120, 1.25])
+    t = j2000 + (between * 1000).astype('timedelta64[ms]')
+    exact_position, exact_velocity = circular_orbit(between)
+    interpolated_position, interpolated_velocity = hermite(times, position, velocity, t)
+    assert interpolated_position.shape == (5, 3)
+    assert np.max(np.linalg.norm(interpolated_position - exact_position, axis = 1)) < 0.1
+    assert np.max(np.linalg.norm(interpolated_velocity - exact_velocity, axis = 1)) < 0.002
+    # Exact for a cubic path between two epochs
+    times = j2000 + np.array([0, 10000], dtype = 'timedelta64[ms]')
+    cubic = lambda s: np.stack([s ** 3, -2 * s ** 2, s + 1], axis = 1)
+    cubic_velocity = lambda s: np.stack([3 * s ** 2, -4 * s, np.ones_like(s)], axis = 1)
+    s = np.array([0, 10.0])
+    t = j2000 + np.array([2500, 7300], dtype = 'timedelta64[ms]')
+    interpolated_position, interpolated_velocity = hermite(times, cubic(s), cubic_velocity(s), t)
+    assert np.allclose(interpolated_position, cubic(np.array([2.5, 7.3])))
+    assert np.allclose(interpolated_velocity, cubic_velocity(np.array([2.5, 7.3])))
+
+
+
+def test_geodetic():
+    e2 = earth_flattening * (2 - earth_flattening)
+    polar_radius = earth_radius * (1 - earth_flattening)
+    times = np.array([j2000] * 4)
+    # At J2000, Greenwich is 280.46061837 degrees east of the X axis
+    phi = np.radians(45.0)
+    n = earth_radius / np.sqrt(1 - e2 * np.sin(phi) ** 2)
+    position = np.array([[earth_radius + 400, 0, 0],
+            [0, 0, polar_radius + 400],
+            [0, 0, -polar_radius],
+            [(n + 100) * np.cos(phi), 0, (n * (1 - e2) + 100) * np.sin(phi)]])
+    latitude, longitude, altitude = geodetic(times, position)
+    assert np.allclose(latitude, [0, 90, -90, 45])
+    assert np.allclose(altitude, [400, 400, 0, 100])
+    assert abs(longitude[0] - (360 - 280.46061837)) < 1e-6
+    assert abs(longitude[3] - longitude[0]) < 1e-9
+    # A sidereal day later, the same inertial point is over the same longitude
+    later = np.array([j2000 + np.timedelta64(86164091, 'ms')])
+    assert abs(geodetic(later, position[:1])[1][0] - longitude[0]) < 1e-3
+
+
+
+def test_parse_times():
+    t = parse_times(['2023-048T12:00:00.000Z', '2023-02-17T12:04:00Z', '2023-02-17T13:08:00+01:00', '2023-02-17T12:12:00.250'])
+    assert t.dtype == np.dtype('datetime64[ms]')
+    assert list(t.astype(str)) == ['2023-02-17T12:00:00.000', '2023-02-17T12:04:00.000', \
+            '2023-02-17T12:08:00.000', '2023-02-17T12:12:00.250']
+    # Strings numpy reads, but parse_time() does not, are refused
+    for text in ['noon', 'NaT', 'now', 'today', '2023', '2023-02']:
+        with pytest.raises(ValueError):
+            parse_times(['2023-02-17T12:00:00Z', text])
+    assert list(parse_times(['2023-02-17']).astype(str)) == ['2023-02-17T00:00:00.000']
+
+
+
+def test_state_vectors():
+    def vector(epoch, texts):
+        item = {'EPOCH': epoch}
+        for axis, text in zip(('X', 'Y', 'Z', 'X_DOT', 'Y_DOT', 'Z_DOT'), texts):
+            item[axis] = {'@units': 'km/s' if axis.endswith('_DOT') else 'km', '#text': text}
+        return item
+    later = vector('2023-048T12:04:00.000Z', ['-4501.8', '2.50000', '1e3', '0.100', '-7.0', '3'])
+    earlier = vector('2023-048T12:00:00.000Z', ['1.000000001', '0', '-0.0', '5.25', '6', '-1.5E-2'])
+    store = StateVectors({'ndm': {'oem': {'body': {'segment': {'data': {'stateVector': [later, earlier]}}}}}})
+    # Sorted by time, with every value returned exactly as written
+    assert store.state(0) == earlier
+    assert store.state(1) == later
+    assert store.position[1].tolist() == [-4501.8, 2.5, 1000.0]
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from synthetic_hgnc import generate_genes
+
+
+
+def connect(use_redis: bool):
+    """Imports the application, backed by a Redis server or a stand-in.
+
+    With use_redis, the application talks to the Redis server at REDIS_IP,
+    127.0.0.1 by default. Otherwise, every Redis client of the application is
+    replaced with an in-process fakeredis stand-in sharing one fake server.
+
+    Args:
+        use_redis: A boolean of whether to use a real Redis server.
+
+    Returns:
+        The genome_database module, ready to be benchmarked.
+    """
+    os.environ.setdefault('REDIS_IP', '127.0.0.1')
+    import genome_database as gdb
+    if not use_redis:
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit('ERROR: the in-process stand-in needs fakeredis, or pass --redis to use a Redis server')
+        server = fakeredis.FakeServer()
+        gdb.rd = fakeredis.FakeRedis(server = server, db = 0, decode_responses = True)
+        gdb.rd_raw = fakeredis.FakeRedis(server = server, db = 0)
+        gdb.rd2 = fakeredis.FakeRedis(server = server, db = 1)
+        gdb.rd3 = fakeredis.FakeRedis(server = server, db = 2, decode_responses = True)
+        gdb.rd_staging = fakeredis.FakeRedis(server = server, db = gdb.staging_db, decode_responses = True)
+    return gdb
+
+
+
+def percentiles(samples: list) -> dict:
+    """Summarizes latency samples.
+
+    Args:
+        samples: A list of float latencies in seconds.
+
+    Returns:
+        A dictionary holding the number of samples and the p50 and p99
+        latencies in milliseconds.
+    """
+    p99 = statistics.quantiles(samples, n = 100)[98] if len(samples) > 1 else samples[0]
+    return {'requests': len(samples), 'p50_ms': statistics.median(samples) * 1000, 'p99_ms': p99 * 1000}
+
+
+
+def time_requests(client, method: str, paths: list, expected: int = 200) -> list:
+    """Times requests made through the Flask test client.
+
+    Args:
+        client: A Flask test client of the application.
+        method: A string of the HTTP method.
+        paths: A list of string paths to request, in order.
+        expected: The integer status code every response must have.
+
+    Returns:
+        A list of the float latency of each request in seconds.
+    """
+    samples = []
+    for path in paths:
+        start = time.perf_counter()
+        response = client.open(path, method = method)
+        samples.append(time.perf_counter() - start)
+        if response.status_code != expected:
+            raise RuntimeError(f'{method} {path} returned {response.status_code}: {response.get_data(as_text = True)[:200]}')
+    return samples
+
+
+
+def run_size(gdb, n: int, lookups: int, listings: int) -> dict:
+    """Loads n synthetic genes, then measures ingest and endpoint latencies.
+
+    Args:
+        gdb: The genome_database module, as returned by connect().
+        n: An integer number of genes.
+        lookups: An integer number of requests for single genes and images.
+        listings: An integer number of requests for /data and /genes.
+
+    Returns:
+        A dictionary holding the ingest throughput of a first load and of a
+        refresh with no changes, and the latency summary of each endpoint.
+    """
+    for client in (gdb.rd, gdb.rd2, gdb.rd3, gdb.rd_staging):
+        client.flushdb()
+    gdb.gene_cache.clear()
+    first = gdb.ingest_genes(generate_genes(n))
+    again = gdb.ingest_genes(generate_genes(n))
+    client = gdb.app.test_client()
+    rng = random.Random(n)
+    results = {'genes': n,
+            'ingest_genes_per_second': first['genes_per_second'],
+            'refresh_genes_per_second': again['genes_per_second'],
+            'endpoints': {}}
+    results['endpoints']['GET /data'] = percentiles(time_requests(client, 'GET', ['/data'] * listings))
+    results['endpoints']['GET /genes'] = percentiles(time_requests(client, 'GET', ['/genes'] * listings))
+    ids = [f'/genes/HGNC:{rng.randint(1, n)}' for ii in range(0, lookups)]
+    results['endpoints']['GET /genes/<id>'] = percentiles(time_requests(client, 'GET', ids))
+    results['endpoints']['POST /image'] = percentiles(time_requests(client, 'POST', ['/image'] * max(1, lookups // 50)))
+    results['endpoints']['GET /image'] = percentiles(time_requests(client, 'GET', ['/image'] * lookups))
+    return results
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark genome_database against synthetic HGNC data.')
+    parser.add_argument('--sizes', default = '1000,10000,40000', help = 'comma-separated numbers of genes')
+    parser.add_argument('--lookups', type = int, default = 500, help = 'requests for single genes and images per size')
+    parser.add_argument('--listings', type = int, default = 5, help = 'requests for /data and /genes per size')
+    parser.add_argument('--redis', action = 'store_true', \
+            help = 'use the Redis server at REDIS_IP, whose databases 0 to 2 and STAGING_DB are flushed, instead of a stand-in')
+    parser.add_argument('--json', action = 'store_true', help = 'print the results as JSON')
+    args = parser.parse_args()
+    gdb = connect(args.redis)
+    results = [run_size(gdb, int(n), args.lookups, args.listings) for n in args.sizes.split(',')]
+    if args.json:
+        print(json.dumps(results, indent = 2))
+        return
+    for result in results:
+        print(f'{result["genes"]} genes: ingest {result["ingest_genes_per_second"]:.0f} genes/s, ' + \
+                f'unchanged refresh {result["refresh_genes_per_second"]:.0f} genes/s')
+        print(f'    {"endpoint":<18}{"requests":>10}{"p50 ms":>10}{"p99 ms":>10}')
+        for endpoint, summary in result['endpoints'].items():
+            print(f'    {endpoint:<18}{summary["requests"]:>10}{summary["p50_ms"]:>10.2f}{summary["p99_ms"]:>10.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import statistics
+import time
+import redis
+import genome_database as gdb
+from synthetic_hgnc import generate_genes
+
+
+
+def measure(client: redis.Redis, raw: redis.Redis, mode: str, mappings: list, reads: int) -> dict:
+    """Loads genes in one storage mode, then measures their memory and reads.
+
+    Args:
+        client: A decoding Redis client for the scratch database.
+        raw: A non-decoding Redis client for the same database.
+        mode: A string of the storage mode, 'hash' or 'blob'.
+        mappings: A list of dictionaries of the flattened attributes of genes.
+        reads: An integer number of single-gene reads to time.
+
+    Returns:
+        A dictionary holding the bytes used per gene, whether they were
+        measured by MEMORY USAGE or only estimated from the payload, and the
+        p50 and p99 latency in microseconds of single-gene reads and of
+        pipelined reads of 500 genes, including decoding.
+    """
+    gdb.storage_mode = mode
+    gdb.rd, gdb.rd_raw = client, raw
+    client.flushdb()
+    pipe = client.pipeline(transaction = False)
+    for mapping in mappings:
+        gdb.write_gene(pipe, mapping['hgnc_id'], mapping)
+    pipe.execute()
+    keys = [mapping['hgnc_id'] for mapping in mappings]
+    try:
+        pipe = client.pipeline(transaction = False)
+        for key in keys:
+            pipe.memory_usage(key, samples = 0)
+        used = sum(pipe.execute())
+        measured = True
+    except redis.exceptions.ResponseError: # e.g. a Redis stand-in without MEMORY USAGE
+        measured = False
+        if mode == 'blob':
+            used = sum(len(gdb.encode_gene(mapping)) for mapping in mappings)
+        else:
+            used = sum(len(str(field)) + len(str(value)) for mapping in mappings for field, value in mapping.items())
+    single = []
+    for key in random.Random(0).choices(keys, k = reads):
+        start = time.perf_counter()
+        gdb.read_genes([key])
+        single.append((time.perf_counter() - start) * 1e6)
+    batched = []
+    for ii in range(0, len(keys) - 499, 500):
+        start = time.perf_counter()
+        gdb.read_genes(keys[ii:ii + 500])
+        batched.append((time.perf_counter() - start) * 1e6)
+    client.flushdb()
+    return {'bytes_per_gene': used / len(keys),
+            'measured': measured,
+            'single_p50': statistics.median(single),
+            'single_p99': statistics.quantiles(single, n = 100)[98],
+            'batch_p50': statistics.median(batched) if len(batched) > 0 else float('nan')}
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare the memory and read latency of the gene storage modes.')
+    parser.add_argument('--genes', type = int, default = 20000, help = 'number of synthetic genes to load')
+    parser.add_argument('--reads', type = int, default = 2000, help = 'number of single-gene reads to time')
+    parser.add_argument('--db', type = int, default = 15, help = 'scratch Redis database, which is flushed')
+    args = parser.parse_args()
+    client = gdb.get_redis_client(args.db, True)
+    raw = gdb.get_redis_client(args.db, False)
+    mappings = [gdb.gene_to_mapping(item) for item in generate_genes(args.genes)]
+    print(f'{"mode":<6}{"bytes/gene":>12}{"get p50 us":>12}{"get p99 us":>12}{"500-get p50 us":>16}')
+    estimated = False
+    for mode in ('hash', 'blob'):
+        result = measure(client, raw, mode, mappings, args.reads)
+        marker = '' if result['measured'] else '*'
+        estimated = estimated or not result['measured']
+        print(f'{mode:<6}{result["bytes_per_gene"]:>11.0f}{marker:1}{result["single_p50"]:>12.0f}' + \
+                f'{result["single_p99"]:>12.0f}{result["batch_p50"]:>16.0f}')
+    if estimated:
+        print('* payload estimate: this server does not support MEMORY USAGE, so bytes/gene is the length of the ' + \
+                'stored fields and values, not the memory used by Redis')
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,22 @@
 import redis
+import redis.client
 import requests
-from flask import Flask, request, send_file
+import ijson
+from flask import Flask, request, send_file, Response, g, has_request_context
+import prometheus_client
+import prometheus_client.multiprocess
 import os
-import matplotlib.pyplot as plt
+import time
+import json
+import hashlib
+import threading
+import io
+import uuid
+import zlib
+import gzip
+import re
+import contextlib
+from collections import OrderedDict
 
 
 
@@ -10,22 +24,1802 @@ import matplotlib.pyplot as plt
 
 app = Flask(__name__)
 source_url = 'https://ftp.ebi.ac.uk/pub/databases/genenames/hgnc/json/hgnc_complete_set.json'
+snapshot_path = os.environ.get('SNAPSHOT_PATH', '/snapshot/hgnc_complete_set.json.gz') # Compressed copy of the last good source
+offline = os.environ.get('OFFLINE', 'false').lower() == 'true' # Refresh from the snapshot rather than source_url
+batch_size = int(os.environ.get('INGEST_BATCH_SIZE', 500)) # Genes per pipeline
+page_size = int(os.environ.get('PAGE_SIZE', 500)) # Default SCAN count per page
+gene_pattern = 'HGNC:*' # Matches gene keys only
+indexed_attributes = [attribute for attribute in os.environ.get('INDEXED_ATTRIBUTES', 'gene_group,locus_type,status,locus_group').split(',') if attribute]
+aggregate_attributes = [attribute for attribute in os.environ.get('AGGREGATE_ATTRIBUTES', 'gene_group,locus_type,locus_group,status').split(',') if attribute]
+identifier_fields = [field for field in os.environ.get('IDENTIFIER_FIELDS', 'ensembl_gene_id,entrez_id,uniprot_ids,refseq_accession,' + \
+        'omim_id,vega_id,ucsc_id,ccds_id,mgd_id,rgd_id,ena').split(',') if field]
+cache_size = int(os.environ.get('GENE_CACHE_SIZE', 1024)) # Genes per replica, 0 disables
+cache_ttl = float(os.environ.get('GENE_CACHE_TTL', 300)) # Seconds
+invalidation_channel = 'gdb:invalidate'
+storage_mode = os.environ.get('GENE_STORAGE', 'hash') # 'hash' or 'blob'
+# Preset zlib dictionary of encoded genes: rarer substrings first, then a typical gene in source order, since zlib
+# matches the end of the dictionary most cheaply. It is a run of substrings, not a JSON document.
+blob_dictionary = b''.join([b'"date_name_changed":"","date_symbol_changed":"","enzyme_id":"","gencc":"HGNC:",',
+        b'"iuphar":"objectId:","lsdb":"","merops":"","mirbase":"","orphanet":"","pseudogene.org":"",',
+        b'"snornabase":"","cd":"","lncipedia":"","rna_central_id":"URS0000","cosmic":"",',
+        b'"status":"Entry Withdrawn","locus_group":"other","locus_type":"unknown",',
+        b'"locus_group":"non-coding RNA","locus_type":"RNA, long non-coding",',
+        b'"locus_group":"pseudogene","locus_type":"pseudogene","refseq_accession":"NR_",',
+        b'{"hgnc_id":"HGNC:","symbol":"","name":"","status":"Approved","locus_group":"protein-coding gene",',
+        b'"locus_type":"gene with protein product","location":"","location_sortable":"",',
+        b'"date_approved_reserved":"","date_modified":"","agr":"HGNC:","uuid":"","_version_":"",',
+        b'"alias_symbol":"","alias_name":"","prev_symbol":"","prev_name":"","gene_group":"","gene_group_id":"",',
+        b'"ensembl_gene_id":"ENSG00000","entrez_id":"","refseq_accession":"NM_","uniprot_ids":"","ccds_id":"CCDS",',
+        b'"omim_id":"","mgd_id":"MGI:","rgd_id":"RGD:","vega_id":"OTTHUMG00000","ucsc_id":"uc0","ena":"",',
+        b'"pubmed_id":"","mane_select":"ENST00000|NM_"}'])
+redis_counts = threading.local()
+request_latency = prometheus_client.Histogram('gdb_request_duration_seconds', 'Latency of HTTP requests.', ['route', 'method'])
+request_total = prometheus_client.Counter('gdb_requests_total', 'HTTP requests answered.', ['route', 'method', 'status'])
+request_commands = prometheus_client.Histogram('gdb_request_redis_commands', 'Redis commands sent per HTTP request.', \
+        ['route', 'method'], buckets = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 10000, float('inf')))
+request_round_trips = prometheus_client.Histogram('gdb_request_redis_round_trips', 'Redis round trips taken per HTTP request.', \
+        ['route', 'method'], buckets = (0, 1, 2, 3, 5, 10, 20, 50, 100, 1000, float('inf')))
+response_size = prometheus_client.Histogram('gdb_response_size_bytes', 'Size of HTTP response bodies.', ['route', 'method'], \
+        buckets = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000, float('inf')))
+job_duration = prometheus_client.Histogram('gdb_job_duration_seconds', 'Duration of ingest and image rendering jobs.', ['job', 'outcome'], \
+        buckets = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf')))
+job_records = prometheus_client.Counter('gdb_job_records_total', 'Records processed by ingest and image rendering jobs.', ['job'])
+cache_gauges = {name: prometheus_client.Gauge(f'gdb_gene_cache_{name}', f'Gene cache {name}, summed over live workers.', \
+        multiprocess_mode = 'livesum') for name in ('hits', 'misses', 'invalidations', 'entries')}
+replicas_healthy = prometheus_client.Gauge('gdb_redis_replicas_healthy', 'Redis replicas currently receiving reads.', \
+        multiprocess_mode = 'livemax')
+if storage_mode not in ('hash', 'blob'):
+    raise Exception(f'GENE_STORAGE must be hash or blob, not {storage_mode}')
+batch_lookup_limit = int(os.environ.get('BATCH_LOOKUP_LIMIT', 1000)) # Genes per /genes/batch request
+search_limit = 100 # Most genes one search may return
+search_separator = '\x00' # Sorts before any character, so exact terms come first
+job_lock_ttl = 600 # Seconds a refresh may go without progress before another may start
+job_ttl = 86400 # Seconds a finished job record is kept
+staging_db = int(os.environ.get('STAGING_DB', 3)) # Logical database each refresh is loaded into
+replica_hosts = [host for host in os.environ.get('REDIS_REPLICAS', '').split(',') if host] # host or host:port
+replica_max_lag = float(os.environ.get('REPLICA_MAX_LAG', 5)) # Seconds a replica may trail the primary
+replica_check_interval = 1 # Seconds between replica health checks
+chart_kinds = ('pie', 'bar')
+chart_limit = 20 # Values drawn per chart, the rest are grouped as 'Other'
+chart_ttl = 86400 # Seconds a rendered chart is kept
 
 
 
 
 
-def get_redis_client(the_db: int = 0, the_decode: bool = False):
+class InstrumentedPipeline(redis.client.Pipeline):
+    """A Redis pipeline which counts its commands and round trips."""
+
+    def execute(self, raise_on_error: bool = True) -> list:
+        count_redis(len(self.command_stack), 1 if len(self.command_stack) > 0 else 0)
+        return super().execute(raise_on_error)
+
+
+
+
+
+class InstrumentedRedis(redis.Redis):
+    """A Redis client which counts its commands and round trips.
+
+    Counts are kept per thread, so they can be attributed to the request being
+    handled by that thread.
+    """
+
+    def execute_command(self, *args, **options):
+        count_redis(1, 1)
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+
+
+
+def count_redis(commands: int, round_trips: int) -> None:
+    """Adds to the Redis command and round trip counts of the current thread.
+
+    Args:
+        commands: An integer number of Redis commands sent.
+        round_trips: An integer number of network round trips taken.
+
+    Returns:
+        None
+    """
+    global redis_counts
+    redis_counts.commands = getattr(redis_counts, 'commands', 0) + commands
+    redis_counts.round_trips = getattr(redis_counts, 'round_trips', 0) + round_trips
+
+
+
+
+
+def get_redis_client(the_db: int = 0, the_decode: bool = False, the_host: str = None):
     """Returns the Redis database client.
 
-    This function returns a Redis object permitting access to a Redis client
-    via 127.0.0.1:6379. The object specifically manipulates database 0. It is
-    set to decode responses from the client from bytes to Python strings.
+    This function returns a Redis object permitting access to one database of
+    a Redis server. By default, it connects to the primary at REDIS_IP, but
+    the_host may name another server, such as a replica, as host or
+    host:port, on port 6379 unless given. Each client has its own connection
+    pool, which every thread shares.
+
+    Args:
+        the_db: The integer number of the database to use.
+        the_decode: A boolean of whether to decode responses from bytes to
+            Python strings.
+        the_host: An optional string of the server, as host or host:port.
+
+    Returns:
+        An InstrumentedRedis client.
+    """
+    redis_host = the_host if the_host is not None else os.environ.get('REDIS_IP')
+    if not redis_host:
+        raise Exception()
+    redis_host, colon, redis_port = redis_host.partition(':')
+    return InstrumentedRedis(host = redis_host, port = int(redis_port or 6379), db = the_db, decode_responses = the_decode)
+
+
+
+
+
+class ReplicaRouter:
+    """Spreads reads across the healthy Redis replicas.
+
+    A background thread writes a heartbeat timestamp to the primary every
+    interval seconds, and reads it back from each replica. A replica is
+    healthy if it answers and its newest heartbeat is no more than max_lag
+    seconds behind the one just replaced, so a replica which is down, cut off
+    from the primary, or trailing it under a heavy refresh stops receiving
+    reads until it catches up.
+    """
+
+    def __init__(self, hosts: list, max_lag: float, interval: float):
+        self.hosts = hosts
+        self.max_lag = max_lag
+        self.interval = interval
+        self.replicas = [(get_redis_client(0, True, host), get_redis_client(0, False, host), \
+                get_redis_client(2, True, host)) for host in hosts]
+        self.lags = [None] * len(hosts)
+        self.healthy = []
+        self.turn = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def check(self) -> None:
+        """Measures the lag of every replica and records which are healthy."""
+        global rd3
+        lags = []
+        for decoded, raw, heartbeat in self.replicas:
+            try:
+                lags.append(max(0.0, time.time() - self.interval - float(heartbeat.get('replicas:heartbeat') or 0)))
+            except (redis.exceptions.RedisError, ValueError):
+                lags.append(None)
+        rd3.set('replicas:heartbeat', time.time())
+        self.lags = lags
+        self.healthy = [ii for ii, lag in enumerate(lags) if lag is not None and lag <= self.max_lag]
+
+    def run(self) -> None:
+        """Checks the replicas every interval seconds, forever."""
+        while True:
+            try:
+                self.check()
+            except Exception as e: # e.g. the primary is down, so lag cannot be measured
+                print(f'ERROR: unable to check Redis replicas\n{e}')
+                self.healthy = []
+            time.sleep(self.interval)
+
+    def choose(self) -> tuple:
+        """Returns the decoding and raw clients of the next healthy replica, or None.
+
+        The health checks start on first use, so importing the application
+        does not connect to Redis.
+        """
+        with self.lock:
+            if self.thread is None and len(self.replicas) > 0:
+                self.thread = threading.Thread(target = self.run, daemon = True)
+                self.thread.start()
+            healthy = self.healthy
+            if len(healthy) == 0:
+                return None
+            self.turn += 1
+            return self.replicas[healthy[self.turn % len(healthy)]][0:2]
+
+
+
+
+
+def get_reader(the_decode: bool = True):
+    """Returns the Redis client the reads of the current request should use.
+
+    GET requests read from the replica chosen for them by route_reads(), or
+    from the primary if there is none. Everything else, including background
+    jobs and the reads which decide what to write, uses the primary.
+
+    Args:
+        the_decode: A boolean of whether the client decodes responses.
+
+    Returns:
+        A Redis client of database 0.
+    """
+    global rd, rd_raw
+    replica = g.get('replica') if has_request_context() else None
+    if replica is not None:
+        return replica[0] if the_decode else replica[1]
+    return rd if the_decode else rd_raw
+
+
+
+
+
+class GeneCache:
+    """A thread-safe, in-process LRU cache of genes with a time to live.
+
+    Entries are evicted once they are older than ttl seconds, or when more
+    than max_entries are held, least recently used first. Clearing the cache
+    bumps its generation, so a lookup which started before the clear cannot
+    store a value read from the old data set. The cache also tracks the
+    version of the live data set, given by each clear, and only stores values
+    read from that version, so a replica lagging behind a refresh cannot
+    refill it with the old data set.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.version = None # Unknown until learned, when nothing is stored
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str):
+        """Returns the cached value of key, or None if absent or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value, generation: int, version: int) -> None:
+        """Stores value under key, unless the cache was cleared since generation or version is not the live one."""
+        if self.max_entries < 1:
+            return
+        with self.lock:
+            if generation != self.generation or version != self.version:
+                return
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+
+    def clear(self, version: int = None) -> None:
+        """Drops every entry, and records the version of the live data set, or None if unknown."""
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+            self.version = version
+            self.invalidations += 1
+
+    def learn(self, version: int, generation: int) -> None:
+        """Records the version of the live data set, unless it is known or the cache was cleared since generation."""
+        with self.lock:
+            if self.version is None and generation == self.generation:
+                self.version = version
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters and the size of the cache."""
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'entries': len(self.entries),
+                    'max_entries': self.max_entries,
+                    'ttl': self.ttl}
+
+
+
+
+
+def start_invalidation_listener() -> None:
+    """Subscribes the gene cache to cross-replica invalidation messages.
+
+    Every replica listens on the invalidation channel in a background thread
+    and clears its gene cache whenever a message arrives, noting the version
+    of the live data set it carries. If the subscription errors, messages may
+    have been missed, so the cache is cleared as well, and forgets the
+    version.
+    The listener is started once, on first use of the cache, so importing the
+    application does not connect to Redis.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    global rd, gene_cache, invalidation_thread, invalidation_lock
+    with invalidation_lock:
+        if invalidation_thread is not None:
+            return
+        def on_error(e, pubsub, thread):
+            print(f'ERROR: cache invalidation listener failed\n{e}')
+            gene_cache.clear()
+            time.sleep(1)
+        pubsub = rd.pubsub(ignore_subscribe_messages = True)
+        def on_message(message):
+            data = message['data']
+            gene_cache.clear(int(data) if data.isdigit() else None)
+        pubsub.subscribe(**{invalidation_channel: on_message})
+        invalidation_thread = pubsub.run_in_thread(sleep_time = 1, daemon = True, exception_handler = on_error)
+
+
+
+
+
+def publish_invalidation() -> None:
+    """Tells every replica, including this one, to clear its gene cache.
+
+    The message carries the version of the live data set, which each cache
+    then requires of the genes it stores.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    global rd, gene_cache
+    version = int(rd.get('meta:version') or 0)
+    gene_cache.clear(version)
+    rd.publish(invalidation_channel, str(version))
+
+
+
+
+
+def gene_to_mapping(item: dict) -> dict:
+    """Flattens a gene record into a Redis hash mapping.
+
+    List attributes are joined into a single string separated by '|', since
+    Redis hashes can only hold flat values. All other attributes are kept
+    as-is.
+
+    Args:
+        item: A dictionary of the attributes of a gene, as in the source data.
+
+    Returns:
+        A dictionary mapping each attribute name to a flat value.
+    """
+    mapping = {}
+    for subkey, value in item.items():
+        if type(value) == list:
+            mapping[subkey] = '|'.join(str(element) for element in value)
+        else:
+            mapping[subkey] = value
+    return mapping
+
+
+
+
+
+def parse_genes(the_file):
+    """Yields the gene records of a streamed source document one at a time.
+
+    This function incrementally parses the response.docs list of the HGNC
+    complete set, so only the gene currently being decoded is held in memory
+    rather than the whole document and parsed document.
+
+    Args:
+        the_file: A binary file object of the HGNC complete set in JSON form,
+            such as the raw stream of a requests Response opened with
+            stream = True, or an opened snapshot.
+
+    Yields:
+        A dictionary of the attributes of a gene, as in the source data.
+    """
+    for item in ijson.items(the_file, 'response.docs.item', use_float = True):
+        yield item
+
+
+
+
+
+class TeeReader:
+    """A binary file object which copies everything read from it to another.
+
+    This lets the source be saved as it is parsed, without reading it twice.
+    The copy is only a convenience, so if writing it fails, the error is
+    logged and kept, and the copy abandoned, while reading carries on.
+    """
+
+    def __init__(self, source, sink):
+        self.source = source
+        self.sink = sink
+        self.error = None
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.source.read(size)
+        if self.error is None:
+            try:
+                self.sink.write(data)
+            except OSError as e:
+                print(f'ERROR: unable to write copy of source, continuing without it\n{e}')
+                self.error = e
+        return data
+
+    def drain(self) -> None:
+        """Reads the rest of the source, so the sink holds all of it, unless the copy was abandoned."""
+        while self.error is None and len(self.read(1 << 16)) > 0:
+            pass
+
+
+
+
+
+def discard_snapshot(the_file) -> None:
+    """Closes and removes a partly written snapshot.
+
+    Errors are ignored, e.g. if the file was never created, so that they
+    cannot hide the error which made the snapshot be discarded.
+
+    Args:
+        the_file: A gzip file object of the partial snapshot.
+
+    Returns:
+        None
+    """
+    with contextlib.suppress(OSError):
+        the_file.close()
+    with contextlib.suppress(OSError):
+        os.remove(the_file.name)
+
+
+
+
+
+def snapshot_enabled() -> bool:
+    """Checks whether a snapshot of the source can be kept.
+
+    Args:
+        None
+
+    Returns:
+        A boolean of whether SNAPSHOT_PATH is set and its directory exists,
+        e.g. because a volume is mounted there.
+    """
+    global snapshot_path
+    return snapshot_path != '' and os.path.isdir(os.path.dirname(os.path.abspath(snapshot_path)))
+
+
+
+
+
+def gene_digest(mapping: dict) -> str:
+    """Returns a hash of the content of a gene.
+
+    Args:
+        mapping: A dictionary of the flattened attributes of a gene.
+
+    Returns:
+        A string of the hexadecimal SHA-1 digest of the attributes.
+    """
+    return hashlib.sha1(json.dumps(mapping, sort_keys = True, default = str).encode()).hexdigest()
+
+
+
+
+
+def index_key(attribute: str, value: str) -> str:
+    """Returns the key of the set indexing genes by an attribute value.
+
+    Args:
+        attribute: A string of the name of the indexed attribute.
+        value: A string of one value of the attribute.
+
+    Returns:
+        A string of the key of the set of hgnc_id's with that value.
+    """
+    return f'index:{attribute}:{value}'
+
+
+
+
+
+def update_indexes(pipe, hgnc_id: str, old: dict, new: dict) -> None:
+    """Queues the index changes for one gene on a pipeline.
+
+    For each indexed attribute, the gene is removed from the sets of values it
+    no longer has and added to the sets of values it newly has. List
+    attributes, stored joined with '|', are indexed under each of their
+    elements.
+
+    Args:
+        pipe: A Redis pipeline to queue the commands on.
+        hgnc_id: A string of the hgnc_id of the gene.
+        old: A dictionary of the previously stored attributes of the gene, or
+            an empty dictionary if it is new.
+        new: A dictionary of the attributes being stored for the gene, or an
+            empty dictionary if it is being removed.
+
+    Returns:
+        None
+    """
+    global indexed_attributes
+    for attribute in indexed_attributes:
+        old_values = set(str(old[attribute]).split('|')) if old.get(attribute) is not None else set()
+        new_values = set(str(new[attribute]).split('|')) if new.get(attribute) is not None else set()
+        for value in old_values - new_values:
+            pipe.srem(index_key(attribute, value), hgnc_id)
+        for value in new_values - old_values:
+            pipe.sadd(index_key(attribute, value), hgnc_id)
+
+
+
+
+
+def update_lookups(pipe, changes: list) -> None:
+    """Queues the reverse lookup changes for several genes on a pipeline.
+
+    Each field in IDENTIFIER_FIELDS has one hash, lookup:<field>, mapping
+    each identifier to the hgnc_id of its gene, or in the rare case it is
+    shared, to the hgnc_id's of its genes joined with '|'. List attributes are
+    looked up under each of their elements. Since an entry may be shared, the
+    entries affected are first read from the staging database, which only the
+    running job writes, in one round trip.
+
+    Args:
+        pipe: A Redis pipeline of the staging database to queue the commands
+            on.
+        changes: A list of tuples, each of the hgnc_id of a gene, a dictionary
+            of its previously stored attributes, and a dictionary of the
+            attributes being stored for it, either of which is empty if the
+            gene is new or being removed.
+
+    Returns:
+        None
+    """
+    global rd_staging, identifier_fields
+    updates = {} # Each changed (field, identifier) to the sets of hgnc_id's removed and added
+    for hgnc_id, old, new in changes:
+        for field in identifier_fields:
+            old_values = set(str(old[field]).split('|')) if old.get(field) is not None else set()
+            new_values = set(str(new[field]).split('|')) if new.get(field) is not None else set()
+            for value in old_values - new_values:
+                updates.setdefault((field, value), (set(), set()))[0].add(hgnc_id)
+            for value in new_values - old_values:
+                updates.setdefault((field, value), (set(), set()))[1].add(hgnc_id)
+    if len(updates) == 0:
+        return
+    entries = list(updates.items())
+    read = rd_staging.pipeline(transaction = False)
+    for (field, value), change in entries:
+        read.hget(f'lookup:{field}', value)
+    for ((field, value), (removed, added)), entry in zip(entries, read.execute()):
+        hgnc_ids = ((set(entry.split('|')) if entry is not None else set()) - removed) | added
+        if len(hgnc_ids) == 0:
+            pipe.hdel(f'lookup:{field}', value)
+        else:
+            pipe.hset(f'lookup:{field}', value, '|'.join(sorted(hgnc_ids)))
+
+
+
+
+
+def update_counts(pipe, old: dict, new: dict) -> None:
+    """Queues the aggregate count changes for one gene on a pipeline.
+
+    For each aggregated attribute, the count of the gene's previous value is
+    decremented and the count of its new value is incremented. Genes missing
+    the attribute are counted under 'N/A'.
+
+    Args:
+        pipe: A Redis pipeline to queue the commands on.
+        old: A dictionary of the previously stored attributes of the gene, or
+            an empty dictionary if it is new.
+        new: A dictionary of the attributes being stored for the gene, or an
+            empty dictionary if it is being removed.
+
+    Returns:
+        None
+    """
+    global aggregate_attributes
+    for attribute in aggregate_attributes:
+        old_value = None if len(old) == 0 else str(old.get(attribute) if old.get(attribute) is not None else 'N/A')
+        new_value = None if len(new) == 0 else str(new.get(attribute) if new.get(attribute) is not None else 'N/A')
+        if old_value == new_value:
+            continue
+        if old_value is not None:
+            pipe.hincrby(f'counts:{attribute}', old_value, -1)
+        if new_value is not None:
+            pipe.hincrby(f'counts:{attribute}', new_value, 1)
+
+
+
+
+
+def get_counts(attribute: str) -> dict:
+    """Gets the maintained count of genes for each value of an attribute.
+
+    Args:
+        attribute: A string of the name of an aggregated attribute.
+
+    Returns:
+        A dictionary mapping each value of the attribute to the integer number
+        of genes with that value, excluding values with no genes.
+    """
+    return {value: int(count) for value, count in get_reader().hgetall(f'counts:{attribute}').items() if int(count) > 0}
+
+
+
+
+
+def encode_gene(mapping: dict) -> bytes:
+    """Packs a gene into a compact blob for the blob storage mode.
+
+    The flattened attributes are serialized as JSON, with every value as a
+    string just as Redis hashes return them, and compressed with zlib using a
+    preset dictionary of the common HGNC field names and values. The first
+    byte records the format, so the encoding can change without breaking
+    stored genes.
+
+    Args:
+        mapping: A dictionary of the flattened attributes of a gene.
+
+    Returns:
+        A bytes object of the encoded gene.
+    """
+    global blob_dictionary
+    compressor = zlib.compressobj(level = 9, zdict = blob_dictionary)
+    data = json.dumps({subkey: str(value) for subkey, value in mapping.items()}, separators = (',', ':')).encode()
+    return b'\x01' + compressor.compress(data) + compressor.flush()
+
+
+
+
+
+def decode_gene(blob: bytes) -> dict:
+    """Unpacks a gene encoded by encode_gene().
+
+    Args:
+        blob: A bytes object of the encoded gene.
+
+    Returns:
+        A dictionary of the attributes of the gene, with string values.
+    """
+    global blob_dictionary
+    if blob[:1] != b'\x01':
+        raise ValueError(f'unknown gene blob format {blob[:1]}')
+    decompressor = zlib.decompressobj(zdict = blob_dictionary)
+    return json.loads(decompressor.decompress(blob[1:]) + decompressor.flush())
+
+
+
+
+
+def write_gene(pipe, key: str, mapping: dict) -> None:
+    """Queues the replacement of one gene on a pipeline.
+
+    In the hash storage mode, the gene is stored as a Redis hash with one field
+    per attribute. In the blob storage mode, it is stored as a single string
+    holding encode_gene() of its attributes.
+
+    Args:
+        pipe: A Redis pipeline to queue the commands on.
+        key: A string of the hgnc_id of the gene.
+        mapping: A dictionary of the flattened attributes of the gene.
+
+    Returns:
+        None
+    """
+    global storage_mode
+    if storage_mode == 'blob':
+        pipe.set(key, encode_gene(mapping))
+    else:
+        pipe.delete(key)
+        pipe.hset(key, mapping = mapping)
+
+
+
+
+
+def read_genes(keys: list, fields: list = None, with_version: bool = False):
+    """Gets the attributes of several genes in one round trip.
+
+    Args:
+        keys: A list of strings, the hgnc_id of each desired gene.
+        fields: An optional list of strings, the names of the only attributes
+            to get. In the hash storage mode, these are fetched with HMGET.
+        with_version: A boolean of whether to also get the version of the
+            data set, from the same server and before the genes.
+
+    Returns:
+        A list of dictionaries holding the attributes of each gene, in the
+        order of keys, or None for genes that are not stored. The result is the
+        same in either storage mode. With with_version, a tuple of that list
+        and the integer version of the data set the genes were read from.
+    """
+    global storage_mode
+    pipe = get_reader(storage_mode != 'blob').pipeline(transaction = False)
+    if with_version:
+        pipe.get('meta:version')
+    if storage_mode == 'blob':
+        for key in keys:
+            pipe.get(key)
+    elif fields is None:
+        for key in keys:
+            pipe.hgetall(key)
+    else:
+        for key in keys:
+            pipe.hmget(key, ['hgnc_id'] + fields) # Every gene has an hgnc_id
+    results = pipe.execute()
+    version = int(results.pop(0) or 0) if with_version else None
+    if storage_mode == 'blob':
+        items = [project_gene(decode_gene(blob), fields) if blob is not None else None for blob in results]
+    elif fields is None:
+        items = [item if len(item) > 0 else None for item in results]
+    else:
+        items = [{field: value for field, value in zip(fields, values[1:]) if value is not None} \
+                if values[0] is not None else None for values in results]
+    return (items, version) if with_version else items
+
+
+
+
+
+def project_gene(item: dict, fields: list = None) -> dict:
+    """Keeps only the requested attributes of a gene.
+
+    Args:
+        item: A dictionary of the attributes of a gene.
+        fields: An optional list of strings, the names of the attributes to
+            keep. If None, every attribute is kept.
+
+    Returns:
+        A dictionary of the requested attributes which the gene has.
+    """
+    if fields is None:
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+
+
+
+
+def lookup_genes(keys: list, fields: list = None) -> list:
+    """Gets several genes through the gene cache.
+
+    Cached genes are served from memory, and the rest are fetched from Redis in
+    one pipelined round trip, along with the version of the data set they
+    come from. Only whole genes of the live version are added to the cache.
+
+    Args:
+        keys: A list of strings, the hgnc_id of each desired gene.
+        fields: An optional list of strings, the names of the only attributes
+            to get.
+
+    Returns:
+        A list of dictionaries holding the attributes of each gene, in the
+        order of keys, or None for genes that are not stored.
+    """
+    global gene_cache
+    start_invalidation_listener()
+    results = [None] * len(keys)
+    missing = []
+    for ii, key in enumerate(keys):
+        item = gene_cache.get(key)
+        if item is not None:
+            results[ii] = project_gene(item, fields)
+        else:
+            missing.append(ii)
+    if len(missing) > 0:
+        generation = gene_cache.generation
+        if gene_cache.version is None: # Not told of a refresh since starting, or since an error
+            gene_cache.learn(int(rd.get('meta:version') or 0), generation)
+        items, version = read_genes([keys[ii] for ii in missing], fields, True)
+        for ii, item in zip(missing, items):
+            if item is not None and fields is None:
+                gene_cache.put(keys[ii], item, generation, version)
+            results[ii] = item
+    return results
+
+
+
+
+
+def get_fields_arg() -> list:
+    """Reads the fields parameter of a request.
+
+    Args:
+        None
+
+    Returns:
+        A list of strings, the comma-separated attribute names given by the
+        fields parameter, or None if it is absent.
+    """
+    if 'fields' not in request.args:
+        return None
+    return [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+
+
+
+
+
+def search_members(hgnc_id: str, item: dict) -> tuple:
+    """Returns the members a gene contributes to the search indexes.
+
+    Each member starts with the lowercase search term, so members sort by term
+    and a prefix can be found with ZRANGEBYLEX. The term is followed by the
+    original term, the attribute it came from, the hgnc_id, and the current
+    symbol, so a search needs no further lookups.
+
+    Args:
+        hgnc_id: A string of the hgnc_id of the gene.
+        item: A dictionary of the attributes of the gene, or an empty
+            dictionary.
+
+    Returns:
+        A tuple of a set of the members of the symbol index and a set of the
+        members of the alias index, which holds alias and previous symbols.
+    """
+    global search_separator
+    symbol = item.get('symbol')
+    symbols = set()
+    aliases = set()
+    if symbol is not None:
+        symbols.add(search_separator.join([symbol.lower(), symbol, 'symbol', hgnc_id, symbol]))
+    for attribute in ('alias_symbol', 'prev_symbol'):
+        if item.get(attribute) is None:
+            continue
+        for term in str(item[attribute]).split('|'):
+            aliases.add(search_separator.join([term.lower(), term, attribute, hgnc_id, symbol or '']))
+    return symbols, aliases
+
+
+
+
+
+def update_search(pipe, hgnc_id: str, old: dict, new: dict) -> None:
+    """Queues the search index changes for one gene on a pipeline.
+
+    Args:
+        pipe: A Redis pipeline to queue the commands on.
+        hgnc_id: A string of the hgnc_id of the gene.
+        old: A dictionary of the previously stored attributes of the gene, or
+            an empty dictionary if it is new.
+        new: A dictionary of the attributes being stored for the gene, or an
+            empty dictionary if it is being removed.
+
+    Returns:
+        None
+    """
+    for key, old_members, new_members in zip(('search:symbol', 'search:alias'), \
+            search_members(hgnc_id, old), search_members(hgnc_id, new)):
+        if len(old_members - new_members) > 0:
+            pipe.zrem(key, *(old_members - new_members))
+        if len(new_members - old_members) > 0:
+            pipe.zadd(key, {member: 0 for member in new_members - old_members})
+
+
+
+
+
+def search_genes(query: str, limit: int) -> list:
+    """Finds genes whose symbol, alias symbol, or previous symbol starts with a query.
+
+    Both search indexes are read in one round trip. Matches are ranked with an
+    exact symbol match first, then other current symbols, then alias and
+    previous symbols, each in alphabetical order, and each gene is listed
+    once. Since a gene may match by several aliases, further pages of the
+    alias index are read until limit genes are found or it is exhausted.
+
+    Args:
+        query: A string of the prefix to search for, in any case.
+        limit: An integer of the maximum number of genes to return.
+
+    Returns:
+        A list of dictionaries, each holding the hgnc_id and current symbol of
+        a matching gene, the term which matched, and the attribute it came
+        from.
+    """
+    global search_separator
+    low = b'[' + query.lower().encode()
+    high = low + b'\xff'
+    reader = get_reader()
+    num = 3 * limit # Allow for duplicates
+    pipe = reader.pipeline(transaction = False)
+    pipe.zrangebylex('search:symbol', low, high, start = 0, num = limit)
+    pipe.zrangebylex('search:alias', low, high, start = 0, num = num)
+    symbols, aliases = pipe.execute()
+    results = []
+    seen = set()
+    members = symbols + aliases
+    start = 0
+    while True:
+        for member in members:
+            lower, term, attribute, hgnc_id, symbol = member.split(search_separator)
+            if hgnc_id in seen:
+                continue
+            seen.add(hgnc_id)
+            results.append({'hgnc_id': hgnc_id, 'symbol': symbol, 'match': term, 'type': attribute})
+            if len(results) >= limit:
+                return results
+        if len(aliases) < num: # The alias index is exhausted
+            return results
+        start += num
+        aliases = reader.zrangebylex('search:alias', low, high, start = start, num = num)
+        members = aliases
+
+
+
+
+
+def band_position(arm: str, band: str) -> float:
+    """Returns the position of a band on a chromosome.
+
+    The digits of a band, region first, are read as a decimal fraction, e.g.
+    q21.31 as 0.2131, so every band sorts within the region or band it
+    belongs to. Positions on the q arm are 1 plus the fraction, and on the p
+    arm, which is numbered from the centromere outwards, -1 minus it, so
+    positions sort from the end of the p arm to the end of the q arm. An arm
+    alone is at the centromeric end of the arm, 1 or -1.
+
+    Args:
+        arm: A string of the arm, 'p' or 'q'.
+        band: A string of the band, e.g. '21.31', or '' for the arm alone.
+
+    Returns:
+        The float position.
+    """
+    fraction = float('0.' + band.replace('.', '')) if band != '' else 0.0
+    return -1.0 - fraction if arm == 'p' else 1.0 + fraction
+
+
+
+
+
+def parse_location(location: str) -> tuple:
+    """Parses a cytogenetic location into its chromosome and position.
+
+    The first band of a location is used, e.g. '17q21.31', '1p36.33-p36.32',
+    or 'Xp22.33 and Yp11.2', and placed by band_position(). The centromere,
+    and locations given only by chromosome, are at 0, between the arms.
+
+    Args:
+        location: A string of the location attribute of a gene.
+
+    Returns:
+        A tuple of the string chromosome, the string arm ('p', 'q', or '' if
+        not given), and the float position, or None if the location does not
+        name a chromosome.
+    """
+    if location is None:
+        return None
+    if location.startswith('mitochondria'):
+        return ('MT', '', 0.0)
+    match = re.match(r'^(\d{1,2}|X|Y)(p|q|cen)?(\d+(?:\.\d+)?)?', location)
+    if match is None:
+        return None
+    if match.group(2) not in ('p', 'q'):
+        return (match.group(1), '', 0.0)
+    return (match.group(1), match.group(2), band_position(match.group(2), match.group(3) or ''))
+
+
+
+
+
+def band_range(band: str) -> tuple:
+    """Returns the range of positions covered by a band.
+
+    A band covers all of its sub-bands, e.g. 'q21' covers q21 through q21.33,
+    a region covers all of its bands, e.g. 'q2' covers q21 through q29.9, and
+    an arm alone covers the whole arm, including genes located only by the
+    arm.
+
+    Args:
+        band: A string of an arm optionally followed by a band, e.g. 'q21',
+            'p13.2', 'q2', or 'q'.
+
+    Returns:
+        A tuple of the lowest and highest float positions in the band, as in
+        band_position().
+
+    Raises:
+        ValueError: If the band is poorly formed.
+    """
+    match = re.fullmatch(r'(p|q)(\d+(?:\.\d+)?)?', band)
+    if match is None:
+        raise ValueError(f'{band} is not a band')
+    if match.group(2) is None:
+        return (-2.0, -1.0) if match.group(1) == 'p' else (1.0, 2.0)
+    digits = match.group(2).replace('.', '')
+    low = band_position('q', match.group(2))
+    high = low + 10.0 ** -len(digits) - 1e-12 # Up to, not including, the next band
+    return (-high, -low) if match.group(1) == 'p' else (low, high)
+
+
+
+
+
+def update_location(pipe, hgnc_id: str, old: dict, new: dict) -> None:
+    """Queues the location index changes for one gene on a pipeline.
+
+    Each chromosome has a sorted set of hgnc_id's scored by their position, as
+    given by parse_location().
+
+    Args:
+        pipe: A Redis pipeline to queue the commands on.
+        hgnc_id: A string of the hgnc_id of the gene.
+        old: A dictionary of the previously stored attributes of the gene, or
+            an empty dictionary if it is new.
+        new: A dictionary of the attributes being stored for the gene, or an
+            empty dictionary if it is being removed.
+
+    Returns:
+        None
+    """
+    old_location = parse_location(old.get('location'))
+    new_location = parse_location(new.get('location'))
+    if old_location == new_location:
+        return
+    if old_location is not None:
+        pipe.zrem(f'location:{old_location[0]}', hgnc_id)
+    if new_location is not None:
+        pipe.zadd(f'location:{new_location[0]}', {hgnc_id: new_location[2]})
+
+
+
+
+
+def update_derived(pipe, hgnc_id: str, old: dict, new: dict) -> None:
+    """Queues the changes to every structure derived from one gene.
+
+    Reverse lookups, whose entries may be shared by several genes, are
+    updated for a whole batch by update_lookups() instead.
+
+    Args:
+        pipe: A Redis pipeline to queue the commands on.
+        hgnc_id: A string of the hgnc_id of the gene.
+        old: A dictionary of the previously stored attributes of the gene, or
+            an empty dictionary if it is new.
+        new: A dictionary of the attributes being stored for the gene, or an
+            empty dictionary if it is being removed.
+
+    Returns:
+        None
+    """
+    update_indexes(pipe, hgnc_id, old, new)
+    update_counts(pipe, old, new)
+    update_search(pipe, hgnc_id, old, new)
+    update_location(pipe, hgnc_id, old, new)
+
+
+
+
+
+def copy_dataset() -> None:
+    """Copies the live dataset into the empty staging database.
+
+    Keys are walked with SCAN and copied with COPY, in pipelines of
+    batch_size keys, so the copy is made within Redis without any gene passing
+    through the application.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    global rd, staging_db, batch_size
+    pipe = rd.pipeline(transaction = False)
+    for ii, key in enumerate(rd.scan_iter(count = batch_size)):
+        pipe.copy(key, key, destination_db = staging_db, replace = True)
+        if (ii + 1) % batch_size == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+
+
+
+def write_batch(batch: list, staged: dict = None) -> dict:
+    """Writes one batch of gene records into the staging database.
+
+    The content hash of each gene is compared against that of the live
+    dataset in a single round trip, to count the genes which were added,
+    changed, and unchanged. Without staged, every gene is written with
+    write_gene(), along with its derived structures and content hash, in one
+    pipeline. With staged, only the added and changed genes are written, and
+    their derived structures are updated from those of the genes they
+    replace. The live dataset is first copied into the staging database with
+    copy_dataset(), once, when the first such gene is found.
+
+    Args:
+        batch: A list of dictionaries, each holding the attributes of a gene as
+            in the source data.
+        staged: An optional dictionary whose 'copied' item is a boolean of
+            whether the staging database holds a copy of the live dataset,
+            for an incremental refresh.
+
+    Returns:
+        A dictionary holding the number of genes added, changed, and unchanged.
+    """
+    global rd, rd_staging
+    counts = {'added': 0, 'changed': 0, 'unchanged': 0}
+    if len(batch) == 0:
+        return counts
+    keys = [f'{item["hgnc_id"]}' for item in batch]
+    mappings = [gene_to_mapping(item) for item in batch]
+    digests = [gene_digest(mapping) for mapping in mappings]
+    stored = rd.hmget('meta:hashes', keys)
+    for digest, old_digest in zip(digests, stored):
+        if old_digest is None:
+            counts['added'] += 1
+        elif old_digest != digest:
+            counts['changed'] += 1
+        else:
+            counts['unchanged'] += 1
+    if staged is None:
+        olds = [{} for key in keys]
+    else:
+        changes = [ii for ii, (digest, old_digest) in enumerate(zip(digests, stored)) if digest != old_digest]
+        if len(changes) == 0:
+            return counts
+        if not staged['copied']:
+            copy_dataset()
+            staged['copied'] = True
+        keys, mappings, digests = [keys[ii] for ii in changes], [mappings[ii] for ii in changes], [digests[ii] for ii in changes]
+        olds = [old or {} for old in read_genes(keys)]
+    pipe = rd_staging.pipeline(transaction = False) # Nothing reads the staging database
+    for key, mapping, digest, old in zip(keys, mappings, digests, olds):
+        write_gene(pipe, key, mapping)
+        update_derived(pipe, key, old, mapping)
+        pipe.hset('meta:hashes', key, digest)
+    update_lookups(pipe, list(zip(keys, olds, mappings)))
+    pipe.execute()
+    return counts
+
+
+
+
+
+def remove_genes(keys: list, staged: dict) -> None:
+    """Removes genes from the staging database, for an incremental refresh.
+
+    Args:
+        keys: A list of strings, the hgnc_id of each gene to remove.
+        staged: The dictionary passed to write_batch() for the refresh.
+
+    Returns:
+        None
+    """
+    global rd_staging
+    if len(keys) == 0:
+        return
+    if not staged['copied']:
+        copy_dataset()
+        staged['copied'] = True
+    pipe = rd_staging.pipeline(transaction = False)
+    olds = [old or {} for old in read_genes(keys)]
+    for key, old in zip(keys, olds):
+        pipe.delete(key)
+        update_derived(pipe, key, old, {})
+        pipe.hdel('meta:hashes', key)
+    update_lookups(pipe, [(key, old, {}) for key, old in zip(keys, olds)])
+    pipe.execute()
+
+
+
+
+
+def get_version() -> int:
+    """Gets the version of the live dataset.
+
+    Args:
+        None
+
+    Returns:
+        The integer version of the dataset readers currently see, or 0 if no
+        dataset has been loaded.
+    """
+    return int(get_reader().get('meta:version') or 0)
+
+
+
+
+
+def swap_dataset() -> int:
+    """Makes the staging database the live dataset.
+
+    The staging database is given the next version number, then swapped with
+    the live database by a single SWAPDB, so readers go straight from the
+    complete old dataset to the complete new one. The old dataset, now in the
+    staging database, is freed by Redis in the background.
+
+    Args:
+        None
+
+    Returns:
+        The integer version of the new live dataset.
+    """
+    global rd, rd3, rd_staging, staging_db
+    version = rd3.incr('jobs:version') # Kept apart from the data, so versions are never reused after a DELETE
+    rd_staging.set('meta:version', version)
+    rd.swapdb(0, staging_db)
+    rd_staging.flushdb(asynchronous = True)
+    return version
+
+
+
+
+
+def ingest_genes(genes, the_batch_size: int = None, progress = None, rebuild: bool = False) -> dict:
+    """Loads a stream of gene records as a new version of the dataset.
+
+    The genes are compared with the live dataset in batches of the_batch_size
+    genes, and the changes are written into the staging database, so readers
+    of the live dataset never see a partial load, nor wait on its writes. The
+    first load, and a rebuild, write every gene into the empty staging
+    database. Otherwise, the refresh is incremental: the staging database is
+    only filled, with a copy of the live dataset, once a gene is found to
+    have been added, changed, or removed, and only those genes are written,
+    so a refresh in which nothing changed writes nothing. Once the stream is
+    exhausted, the staging database is swapped in with swap_dataset() if any
+    gene was added, changed, or removed relative to the live dataset, or if
+    rebuild is true, and dropped otherwise.
+
+    Args:
+        genes: An iterable of dictionaries, each holding the attributes of a
+            gene as in the source data.
+        the_batch_size: The number of genes sent per pipeline. Defaults to the
+            INGEST_BATCH_SIZE environment variable, or 500.
+        progress: An optional function called with the running statistics
+            after each batch is written.
+        rebuild: A boolean of whether to swap in the new dataset even if no
+            gene changed, e.g. so that its derived structures follow a change
+            of INDEXED_ATTRIBUTES or AGGREGATE_ATTRIBUTES.
+
+    Returns:
+        A dictionary holding the number of genes processed, added, changed,
+        removed, and unchanged, the version of the live dataset afterwards,
+        the elapsed time in seconds, and the throughput in genes per second.
     """
-    redis_host = os.environ.get('REDIS_IP')
-    if not redis_host:
-        raise Exception()
-    return redis.Redis(host = redis_host, port = 6379, db = the_db, decode_responses = the_decode)
+    global rd, rd_staging, batch_size
+    if the_batch_size is None:
+        the_batch_size = batch_size
+    start = time.perf_counter()
+    stats = {'genes': 0, 'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+    seen = set()
+    batch = []
+    staged = None if rebuild or not rd.exists('meta:version') else {'copied': False}
+    rd_staging.flushdb() # Left over from an interrupted refresh
+    try:
+        for item in genes:
+            batch.append(item)
+            seen.add(f'{item["hgnc_id"]}')
+            if len(batch) >= the_batch_size:
+                for name, value in write_batch(batch, staged).items():
+                    stats[name] += value
+                stats['genes'] += len(batch)
+                batch = []
+                if progress is not None:
+                    progress(stats)
+        for name, value in write_batch(batch, staged).items():
+            stats[name] += value
+        stats['genes'] += len(batch)
+        if progress is not None:
+            progress(stats)
+        removed = [key for key, digest in rd.hscan_iter('meta:hashes', count = the_batch_size) if key not in seen]
+        stats['removed'] = len(removed)
+        if staged is not None:
+            for ii in range(0, len(removed), the_batch_size):
+                remove_genes(removed[ii:ii + the_batch_size], staged)
+    except Exception:
+        rd_staging.flushdb(asynchronous = True)
+        raise
+    if rebuild or stats['added'] + stats['changed'] + stats['removed'] > 0 or not rd.exists('meta:version'):
+        stats['version'] = swap_dataset()
+    else:
+        rd_staging.flushdb(asynchronous = True)
+        stats['version'] = get_version()
+    stats['seconds'] = time.perf_counter() - start
+    stats['genes_per_second'] = stats['genes'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    return stats
+
+
+
+
+
+def refresh_data(the_batch_size: int = None, force: bool = False, progress = None, source: str = 'remote') -> dict:
+    """Refreshes the database from the source data or its snapshot.
+
+    From the remote source, the stored ETag and Last-Modified validators are
+    sent with the request, and if the source has not changed, nothing is
+    downloaded. Otherwise, the source is streamed into ingest_genes() and, if
+    snapshot_enabled(), into a gzip file at the same time. Once the genes are
+    loaded, the new validators are saved with the live dataset and the gzip
+    file replaces the snapshot, so the snapshot always holds the last source
+    which was loaded in full. The snapshot is only a convenience, so if it
+    cannot be written, the error is logged, the previous snapshot kept, and
+    the refresh carries on without it. From the snapshot, it is streamed into
+    ingest_genes() instead, without any network access. Either way, every
+    replica is told to clear its gene cache as soon as a new version of the
+    dataset is swapped in, before anything else can fail.
+
+    Args:
+        the_batch_size: The number of genes sent per pipeline.
+        force: A boolean of whether to download the source even if its
+            validators have not changed, and swap in the new dataset even if
+            no gene changed.
+        progress: An optional function passed on to ingest_genes().
+        source: A string of where to read the genes from, 'remote' for
+            source_url or 'snapshot' for snapshot_path.
+
+    Returns:
+        A dictionary of the statistics returned by ingest_genes(), or None if
+        the data was already up to date.
+    """
+    global rd, source_url, snapshot_path
+    previous = get_version()
+    def ingest(stream) -> dict:
+        stats = ingest_genes(parse_genes(stream), the_batch_size, progress, force)
+        if stats['version'] != previous:
+            publish_invalidation()
+        return stats
+    if source == 'snapshot':
+        with gzip.open(snapshot_path, 'rb') as the_file:
+            return ingest(the_file)
+    snapshot = snapshot_enabled()
+    validators = {} if force or (snapshot and not os.path.exists(snapshot_path)) else rd.hgetall('meta:source')
+    headers = {}
+    if 'etag' in validators:
+        headers['If-None-Match'] = validators['etag']
+    if 'last_modified' in validators:
+        headers['If-Modified-Since'] = validators['last_modified']
+    with requests.get(url = source_url, stream = True, headers = headers) as response:
+        if response.status_code == 304 or (len(validators) > 0 and \
+                validators.get('etag') == response.headers.get('ETag') and \
+                validators.get('last_modified') == response.headers.get('Last-Modified')):
+            return None
+        response.raise_for_status()
+        response.raw.decode_content = True # Let urllib3 undo gzip encoding
+        stream, the_file = response.raw, None
+        if snapshot:
+            partial = f'{snapshot_path}.partial'
+            try:
+                the_file = gzip.open(partial, 'wb', compresslevel = 6)
+                stream = TeeReader(response.raw, the_file)
+            except OSError as e:
+                print(f'ERROR: unable to write snapshot, continuing without it\n{e}')
+        try:
+            stats = ingest(stream)
+        except Exception:
+            if the_file is not None:
+                discard_snapshot(the_file)
+            raise
+        if the_file is not None:
+            try:
+                stream.drain()
+                the_file.close()
+                if stream.error is not None:
+                    raise stream.error
+                os.replace(partial, snapshot_path)
+            except Exception as e:
+                print(f'ERROR: unable to save snapshot, keeping the previous one\n{e}')
+                discard_snapshot(the_file)
+        pipe = rd.pipeline(transaction = True)
+        pipe.delete('meta:source')
+        if response.headers.get('ETag') is not None:
+            pipe.hset('meta:source', 'etag', response.headers['ETag'])
+        if response.headers.get('Last-Modified') is not None:
+            pipe.hset('meta:source', 'last_modified', response.headers['Last-Modified'])
+        pipe.execute()
+    return stats
+
+
+
+
+
+def run_refresh_job(job_id: str, the_batch_size: int, force: bool, source: str = 'remote') -> None:
+    """Runs a refresh of the database as a background job.
+
+    The job record is updated as each batch is written, which also renews the
+    lock preventing duplicate refreshes and the expiry of the record, and is
+    marked as succeeded or failed once the refresh ends. The lock is then
+    released.
+
+    Args:
+        job_id: A string of the id of the job.
+        the_batch_size: The number of genes sent per pipeline.
+        force: A boolean of whether to download the source even if its
+            validators have not changed.
+        source: A string of where to read the genes from, 'remote' or
+            'snapshot'.
+
+    Returns:
+        None
+    """
+    global rd3, job_lock_ttl, job_ttl
+    job_key = f'job:{job_id}'
+    start = time.perf_counter()
+    pipe = rd3.pipeline(transaction = False)
+    pipe.hset(job_key, mapping = {'state': 'running', 'started': time.time()})
+    pipe.expire(job_key, job_ttl)
+    pipe.execute()
+    def progress(stats):
+        pipe = rd3.pipeline(transaction = False)
+        pipe.hset(job_key, mapping = {name: stats[name] for name in ('genes', 'added', 'changed', 'unchanged')})
+        pipe.expire(job_key, job_ttl)
+        pipe.expire('jobs:active', job_lock_ttl)
+        pipe.execute()
+    try:
+        stats = refresh_data(the_batch_size, force, progress, source)
+        if stats is None:
+            result = {'state': 'succeeded', 'message': 'Data already up to date'}
+        else:
+            summary = f'{stats["added"]} added, {stats["changed"]} changed, {stats["removed"]} removed, ' + \
+                    f'{stats["unchanged"]} unchanged in {stats["seconds"]:.2f} s ({stats["genes_per_second"]:.0f} genes/s)'
+            print(f'INFO: ingested {stats["genes"]} genes: {summary}')
+            result = {name: stats[name] for name in ('genes', 'added', 'changed', 'removed', 'unchanged', 'version')}
+            result.update({'state': 'succeeded', 'message': f'Data successfully posted: {summary}'})
+    except Exception as e:
+        print(f'ERROR: unable to post data\n{e}')
+        result = {'state': 'failed', 'error': f'{type(e).__name__}: {e}'}
+    job_duration.labels('ingest', result['state']).observe(time.perf_counter() - start)
+    job_records.labels('ingest').inc(result.get('genes', 0))
+    result['finished'] = time.time()
+    pipe = rd3.pipeline(transaction = True)
+    pipe.hset(job_key, mapping = result)
+    pipe.expire(job_key, job_ttl)
+    pipe.execute()
+    if rd3.get('jobs:active') == job_id:
+        rd3.delete('jobs:active')
+
+
+
+
+
+def get_job(job_id: str) -> dict:
+    """Gets the record of a refresh job.
+
+    A job which is queued or running but no longer holds the refresh lock has
+    stopped without finishing, e.g. because its worker was restarted, so it
+    is marked as failed.
+
+    Args:
+        job_id: A string of the id of the job.
+
+    Returns:
+        A dictionary holding the id, state, number of genes processed, added,
+        changed, removed, and unchanged, dataset version, elapsed time in
+        seconds, and message or error of the job, or None if there is no such
+        job.
+    """
+    global rd3
+    job = rd3.hgetall(f'job:{job_id}')
+    if len(job) == 0:
+        return None
+    if job.get('state') in ('queued', 'running') and rd3.get('jobs:active') != job_id: # Finished jobs are marked before unlocking
+        lapsed = {'state': 'failed', 'error': 'the refresh stopped without finishing, and its lock lapsed', 'finished': time.time()}
+        rd3.hset(f'job:{job_id}', mapping = lapsed)
+        job.update(lapsed)
+    for name in ('genes', 'added', 'changed', 'removed', 'unchanged', 'version'):
+        if name in job:
+            job[name] = int(job[name])
+    if 'started' in job:
+        job['elapsed'] = float(job.get('finished', time.time())) - float(job['started'])
+    for name in ('created', 'started', 'finished'):
+        if name in job:
+            job[name] = float(job[name])
+    return job
+
+
+
+
+
+def get_genes(keys: list) -> list:
+    """Gets the attributes of several genes in one round trip.
+
+    Args:
+        keys: A list of strings, the hgnc_id of each desired gene.
+
+    Returns:
+        A list of dictionaries holding the attributes of each gene that still
+        exists, in the order of keys.
+    """
+    return [item for item in read_genes(keys) if item is not None]
+
+
+
+
+
+def get_page_args() -> tuple:
+    """Reads the cursor and count pagination parameters of a request.
+
+    Args:
+        None
+
+    Returns:
+        A tuple of the integer SCAN cursor and the integer count hint, or None
+        if the request does not ask for a page.
+
+    Raises:
+        ValueError: If either parameter is not a non-negative integer, or
+            count is zero.
+    """
+    global page_size
+    if 'cursor' not in request.args and 'count' not in request.args:
+        return None
+    cursor = int(request.args.get('cursor', 0))
+    count = int(request.args.get('count', page_size))
+    if cursor < 0 or count < 1:
+        raise ValueError()
+    return cursor, count
+
+
+
+
+
+def get_chart_args() -> tuple:
+    """Reads the attribute and kind parameters of an /image request.
+
+    Args:
+        None
+
+    Returns:
+        A tuple of the string attribute, which defaults to gene_group, and the
+        string kind of chart, which defaults to pie.
+
+    Raises:
+        ValueError: If the attribute is not aggregated, or the kind is not
+            one of chart_kinds.
+    """
+    global aggregate_attributes, chart_kinds
+    attribute = request.args.get('attribute', 'gene_group')
+    kind = request.args.get('kind', 'pie')
+    if attribute not in aggregate_attributes:
+        raise ValueError(f'{attribute} is not an aggregated attribute')
+    if kind not in chart_kinds:
+        raise ValueError(f'kind must be one of {", ".join(chart_kinds)}')
+    return attribute, kind
+
+
+
+
+
+def chart_key(attribute: str, kind: str, version: int) -> str:
+    """Builds the Redis key of a rendered chart.
+
+    Args:
+        attribute: A string of the name of the charted attribute.
+        kind: A string of the kind of chart.
+        version: The integer version of the dataset the chart was drawn from.
+
+    Returns:
+        A string of the key of the chart's hash in Redis database 1.
+    """
+    return f'image:{version}:{attribute}:{kind}'
+
+
+
+
+
+def render_chart(attribute: str, kind: str, counts: dict) -> bytes:
+    """Draws a chart of the number of genes with each value of an attribute.
+
+    matplotlib is only imported on the first call, and the figure is drawn
+    without pyplot, so no interactive backend or global figure state is
+    involved and concurrent requests may render at once. Values beyond the
+    chart_limit most common are grouped as 'Other'.
+
+    Args:
+        attribute: A string of the name of the charted attribute.
+        kind: A string of the kind of chart, 'pie' or 'bar'.
+        counts: A dictionary mapping each value of the attribute to the integer
+            number of genes with that value.
+
+    Returns:
+        The bytes of the chart as a PNG image.
+    """
+    global chart_limit
+    from matplotlib.figure import Figure
+    ordered = sorted(counts.items(), key = lambda item: item[1], reverse = True)
+    the_labels = [value for value, count in ordered[:chart_limit]]
+    values = [count for value, count in ordered[:chart_limit]]
+    if len(ordered) > chart_limit:
+        the_labels.append('Other')
+        values.append(sum(count for value, count in ordered[chart_limit:]))
+    fig = Figure(figsize = (8, 6))
+    ax = fig.subplots()
+    if kind == 'pie':
+        # Remove trivial labels for legibility
+        s = sum(values)
+        ax.pie(values, labels = [label if count / s >= 0.03 else '' for label, count in zip(the_labels, values)])
+    else:
+        ax.barh(the_labels[::-1], values[::-1])
+        ax.set_xlabel('Genes')
+    ax.set_title(f'Genes by {attribute}')
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format = 'png')
+    return buffer.getvalue()
+
+
+
+
+
+def cache_chart(attribute: str, kind: str) -> tuple:
+    """Renders a chart from the aggregate counts and caches it.
+
+    The dataset version and the counts are read in one transaction, so the
+    chart is always cached under the version it was drawn from.
+
+    Args:
+        attribute: A string of the name of the charted attribute.
+        kind: A string of the kind of chart.
+
+    Returns:
+        A tuple of the bytes of the PNG image and the string of its ETag, or
+        None if there is no data to plot.
+    """
+    global rd2, chart_ttl
+    start = time.perf_counter()
+    pipe = get_reader().pipeline(transaction = True)
+    pipe.get('meta:version')
+    pipe.hgetall(f'counts:{attribute}')
+    version, counts = pipe.execute()
+    counts = {value: int(count) for value, count in counts.items() if int(count) > 0}
+    if len(counts) == 0:
+        return None
+    try:
+        image_data = render_chart(attribute, kind, counts)
+    except Exception:
+        job_duration.labels('image', 'failed').observe(time.perf_counter() - start)
+        raise
+    etag = hashlib.sha1(image_data).hexdigest()
+    key = chart_key(attribute, kind, int(version or 0))
+    pipe = rd2.pipeline(transaction = True)
+    pipe.hset(key, mapping = {'png': image_data, 'etag': etag})
+    pipe.expire(key, chart_ttl)
+    pipe.execute()
+    job_duration.labels('image', 'succeeded').observe(time.perf_counter() - start)
+    job_records.labels('image').inc(sum(counts.values()))
+    return image_data, etag
+
+
+
+
+
+@app.before_request
+def route_reads() -> None:
+    """Chooses the replica the reads of a request should use, if any.
+
+    Only GET requests are routed to replicas. Paginated requests, with a
+    cursor or a count, stay on the primary, since a SCAN cursor is only
+    meaningful to the server which returned it, and the first page returns
+    the cursor of the next.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    global replica_router
+    g.replica = None
+    if request.method == 'GET' and 'cursor' not in request.args and 'count' not in request.args \
+            and len(replica_router.replicas) > 0:
+        g.replica = replica_router.choose()
+
+
+
+
+
+@app.before_request
+def start_metrics() -> None:
+    """Starts timing a request and counting its Redis traffic.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    global redis_counts
+    g.start = time.perf_counter()
+    redis_counts.commands = 0
+    redis_counts.round_trips = 0
+
+
+
+
+
+@app.after_request
+def record_metrics(response):
+    """Records the latency, Redis traffic, and size of a request.
+
+    The gene cache and replica gauges of this worker are refreshed too, so
+    they are current whichever worker answers /metrics.
+
+    Args:
+        response: The Flask response to the request.
+
+    Returns:
+        The same response.
+    """
+    global redis_counts, gene_cache, replica_router
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_latency.labels(route, request.method).observe(time.perf_counter() - g.start)
+    request_total.labels(route, request.method, str(response.status_code)).inc()
+    request_commands.labels(route, request.method).observe(getattr(redis_counts, 'commands', 0))
+    request_round_trips.labels(route, request.method).observe(getattr(redis_counts, 'round_trips', 0))
+    if response.content_length is not None:
+        response_size.labels(route, request.method).observe(response.content_length)
+    for name, value in gene_cache.stats().items():
+        if name in cache_gauges:
+            cache_gauges[name].set(value)
+    replicas_healthy.set(len(replica_router.healthy))
+    return response
+
+
+
+
+
+@app.route('/ready', methods = ['GET'])
+def ready():
+    """/ready endpoint
+
+    This function reports whether this worker can serve requests, i.e.
+    whether it can reach the Redis primary, for use as a readiness probe.
+
+    Args:
+        None
+
+    Returns:
+        A dictionary holding whether the worker is ready, its process id, and
+        the version of the live dataset, 0 if none is loaded. If Redis cannot
+        be reached, ready is false and the status code is 503.
+    """
+    global rd
+    try:
+        rd.ping()
+        return {'ready': True, 'pid': os.getpid(), 'version': get_version()}
+    except Exception as e:
+        print(f'ERROR: unable to reach Redis\n{e}')
+        return {'ready': False, 'pid': os.getpid(), 'error': f'{type(e).__name__}: {e}'}, 503
+
+
+
+
+
+@app.route('/metrics', methods = ['GET'])
+def metrics():
+    """/metrics endpoint
+
+    This function returns the metrics of this replica in the Prometheus text
+    format, i.e. latency histograms per route and method, Redis commands and
+    round trips per request, response sizes, ingest and image job durations
+    and records processed, and gene cache counters. Under a multi-worker
+    server which sets PROMETHEUS_MULTIPROC_DIR, the metrics of every worker
+    are combined.
+
+    Args:
+        None
+
+    Returns:
+        A string of the metrics in the Prometheus text format.
+    """
+    registry = prometheus_client.REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_client.multiprocess.MultiProcessCollector(registry)
+    return Response(prometheus_client.generate_latest(registry), content_type = prometheus_client.CONTENT_TYPE_LATEST)
 
 
 
@@ -44,50 +1838,88 @@ def data():
 
     Returns:
         If the method is GET, a list of dictionaries representing each entry in
-            the database. If there is an error, a descriptive string will be
-            returned with a 500 status code. Note that sparse attributes are
-            excluded.
-        If the method is SET, a text message informing the user of success. If
-            there is an error, a descriptive string will be returned with a 500
-            status code.
+            the database. If the integer parameters cursor or count are given,
+            a single page is returned instead as a dictionary holding the next
+            cursor and the list of entries, where a next cursor of 0 means the
+            listing is complete. If there is an error, a descriptive string
+            will be returned with a 500 status code. Note that sparse
+            attributes are excluded.
+        If the method is SET, a dictionary describing a background refresh
+            job, with a 202 status code. The job's progress can be followed at
+            /jobs/<id>. If a refresh is already running, that job is returned
+            instead of starting another. The download is skipped if the
+            source's ETag or Last-Modified header has not changed since the
+            last refresh, unless the parameter force is true. The optional
+            integer parameter batch_size sets the number of genes sent to Redis
+            per pipeline. The optional parameter source=snapshot reloads from
+            the local snapshot of the last source instead, which is the
+            default in offline mode. If the source is invalid or there is no
+            snapshot, a descriptive string will be returned with a 404 status
+            code. If there is an error, a descriptive string will be returned
+            with a 500 status code.
         If the method is DELETE, a text message informing the user of success.
-            If there is an error, a descriptive string will be returned with a
-            500 status code.
+            If a refresh is running, a descriptive string will be returned with
+            a 409 status code. If there is an error, a descriptive string will
+            be returned with a 500 status code.
     """
-    global rd, source_url
+    global rd, rd3, batch_size, job_lock_ttl, job_ttl, offline, snapshot_path
     if request.method == 'GET':
         try:
+            page = get_page_args()
+        except ValueError:
+            return f'ERROR: cursor and count must be non-negative integers', 404
+        try:
+            reader = get_reader()
+            if page is not None:
+                cursor, keys = reader.scan(page[0], match = gene_pattern, count = page[1])
+                return {'cursor': cursor, 'data': get_genes(keys)}
             data = []
-            keys = rd.keys()
-            for key in keys:
-                data.append(rd.hgetall(key))
+            keys = []
+            for key in reader.scan_iter(match = gene_pattern, count = page_size):
+                keys.append(key)
+                if len(keys) >= page_size:
+                    data.extend(get_genes(keys))
+                    keys = []
+            data.extend(get_genes(keys))
             return data
         except Exception as e:
             print(f'ERROR: unable to get data\n{e}')
             return f'ERROR: unable to get data', 500
     elif request.method == 'POST':
         try:
-            the_json = requests.get(url = source_url).json()
-            data = the_json['response']['docs']
-            for item in data:
-                key = f'{item["hgnc_id"]}'
-                subkeys = item.keys()
-                for subkey in subkeys:
-                    if type(item[subkey]) == list:
-                        listitem = ''
-                        for j in range(0, len(item[subkey]) - 1):
-                            listitem = f'{listitem}{item[subkey][j]}|'
-                        listitem = f'{listitem}{item[subkey][len(item[subkey]) - 1]}'
-                        rd.hset(key, subkey, listitem)
-                    else:
-                        rd.hset(key, subkey, item[subkey])
-            return 'Data successfully posted', 200
+            the_batch_size = int(request.args.get('batch_size', batch_size))
+            if the_batch_size < 1:
+                raise ValueError()
+        except ValueError:
+            return f'ERROR: batch_size must be a positive integer', 404
+        force = request.args.get('force', 'false').lower() == 'true'
+        source = request.args.get('source', 'snapshot' if offline else 'remote')
+        if source not in ('remote', 'snapshot'):
+            return f'ERROR: source must be remote or snapshot', 404
+        if source == 'snapshot' and not os.path.exists(snapshot_path):
+            return f'ERROR: there is no snapshot at {snapshot_path}', 404
+        try:
+            job_id = uuid.uuid4().hex
+            if not rd3.set('jobs:active', job_id, nx = True, ex = job_lock_ttl):
+                active = get_job(rd3.get('jobs:active'))
+                if active is not None:
+                    return active, 202, {'Location': f'/jobs/{active["id"]}'}
+                return f'ERROR: a refresh is already starting', 409
+            pipe = rd3.pipeline(transaction = False)
+            pipe.hset(f'job:{job_id}', mapping = {'id': job_id, 'state': 'queued', 'source': source, 'created': time.time()})
+            pipe.expire(f'job:{job_id}', job_ttl) # Renewed as the job progresses, so a lost job is not kept forever
+            pipe.execute()
+            threading.Thread(target = run_refresh_job, args = (job_id, the_batch_size, force, source), daemon = True).start()
+            return get_job(job_id), 202, {'Location': f'/jobs/{job_id}'}
         except Exception as e:
             print(f'ERROR: unable to post data\n{e}')
             return f'ERROR: unable to post data', 500
     elif request.method == 'DELETE':
         try:
+            if rd3.exists('jobs:active'):
+                return f'ERROR: a refresh is running', 409
             rd.flushdb()
+            publish_invalidation()
             return 'Data successfully deleted', 200
         except Exception as e:
             print(f'ERROR: unable to delete data\n{e}')
@@ -97,21 +1929,95 @@ def data():
 
 
 
+@app.route('/jobs/<string:job_id>', methods = ['GET'])
+def jobs_job_id(job_id: str):
+    """/jobs/<string:job_id> endpoint
+
+    This function returns the progress of a refresh job started by POST /data.
+    Finished jobs are kept for a day, and jobs which stopped without finishing
+    are reported as failed.
+
+    Args:
+        job_id: A string of the id of the job.
+
+    Returns:
+        A dictionary holding the state of the job, i.e. queued, running,
+        succeeded, or failed, the number of genes processed, added, changed,
+        removed, and unchanged so far, the elapsed time in seconds, and a
+        message or error once it has finished.
+    """
+    try:
+        job = get_job(job_id)
+        if job is None:
+            return f'ERROR: Job {job_id} not found.', 404
+        return job
+    except Exception as e:
+        print(f'ERROR: unable to get job.\n{e}')
+        return f'ERROR: unable to get job.', 500
+
+
+
+
+
 @app.route('/genes', methods = ['GET'])
 def genes():
     """/genes endpoint
 
-    This function returns all of the gene IDs, i.e. hgnc_id, in the set.
+    This function returns all of the gene IDs, i.e. hgnc_id, in the set. If
+    the integer parameters cursor or count are given, only one page of the set
+    is returned. The chromosome parameter, e.g. chromosome=17, limits the set
+    to genes on that chromosome, optionally between the band_from and band_to
+    parameters, e.g. band_from=q21&band_to=q22, in order of position. Any
+    other parameter filters the set by an indexed attribute, e.g.
+    locus_type=gene%20with%20protein%20product, and multiple filters are
+    combined by set intersection.
 
     Args:
         None
 
     Returns:
-        A list of strings, the hgnc_id of each entry.
+        A list of strings, the hgnc_id of each entry. If a page is requested,
+        a dictionary holding the next cursor and the list of strings, where a
+        next cursor of 0 means the listing is complete.
     """
-    global rd
+    global page_size, indexed_attributes
+    try:
+        page = get_page_args()
+    except ValueError:
+        return f'ERROR: cursor and count must be non-negative integers', 404
+    location_args = ('chromosome', 'band_from', 'band_to')
+    filters = [(attribute, value) for attribute in request.args if attribute not in ('cursor', 'count') + location_args \
+            for value in request.args.getlist(attribute)]
+    for attribute, value in filters:
+        if attribute not in indexed_attributes:
+            return f'ERROR: {attribute} is not an indexed attribute', 404
+    chromosome = request.args.get('chromosome')
+    if chromosome is None and ('band_from' in request.args or 'band_to' in request.args):
+        return f'ERROR: band_from and band_to require a chromosome', 404
     try:
-        return rd.keys()
+        low = band_range(request.args['band_from'])[0] if 'band_from' in request.args else '-inf'
+        high = band_range(request.args['band_to'])[1] if 'band_to' in request.args else '+inf'
+    except ValueError:
+        return f'ERROR: band_from and band_to must be an arm and optional band, e.g. q21', 404
+    if (len(filters) > 0 or chromosome is not None) and page is not None:
+        return f'ERROR: filters cannot be combined with cursor or count', 404
+    try:
+        reader = get_reader()
+        if chromosome is not None:
+            pipe = reader.pipeline(transaction = False)
+            pipe.zrangebyscore(f'location:{chromosome}', low, high)
+            if len(filters) > 0:
+                pipe.sinter([index_key(attribute, value) for attribute, value in filters])
+            results = pipe.execute()
+            if len(filters) > 0:
+                return [key for key in results[0] if key in results[1]]
+            return results[0]
+        if len(filters) > 0:
+            return sorted(reader.sinter([index_key(attribute, value) for attribute, value in filters]))
+        if page is not None:
+            cursor, keys = reader.scan(page[0], match = gene_pattern, count = page[1])
+            return {'cursor': cursor, 'genes': keys}
+        return list(reader.scan_iter(match = gene_pattern, count = page_size))
     except Exception as e:
         print(f'ERROR: unable to get gene ID\'s\n{e}')
         return f'ERROR: unable to get gene ID\'s', 500
@@ -120,12 +2026,136 @@ def genes():
 
 
 
+@app.route('/genes/batch', methods = ['POST'])
+def genes_batch():
+    """/genes/batch endpoint
+
+    This function returns the data for several genes at once, fetching every
+    gene which is not cached in one round trip to Redis. The body is a JSON
+    list of hgnc_id's, or a dictionary holding such a list under "ids" and
+    optionally a list of attribute names under "fields". The attributes may
+    also be given by the comma-separated fields parameter.
+
+    Args:
+        None
+
+    Returns:
+        A dictionary holding a dictionary of the attributes of each gene found,
+        keyed by hgnc_id, and a list of the hgnc_id's which were not found. If
+        the body is poorly formed or holds too many ids, a descriptive string
+        will be returned with a 404 status code.
+    """
+    global batch_lookup_limit
+    body = request.get_json(silent = True)
+    fields = get_fields_arg()
+    if type(body) == dict:
+        if body.get('fields') is not None:
+            fields = body['fields']
+        body = body.get('ids')
+    if type(body) != list or not all(type(key) == str for key in body) or \
+            (fields is not None and (type(fields) != list or not all(type(field) == str for field in fields))):
+        return f'ERROR: body must be a list of hgnc_id strings, or a dictionary with one under ids', 404
+    if len(body) > batch_lookup_limit:
+        return f'ERROR: at most {batch_lookup_limit} genes may be requested at once', 404
+    try:
+        items = lookup_genes(body, fields)
+        return {'genes': {key: item for key, item in zip(body, items) if item is not None},
+                'not_found': [key for key, item in zip(body, items) if item is None]}
+    except Exception as e:
+        print(f'ERROR: unable to get genes.\n{e}')
+        return f'ERROR: unable to get genes.', 500
+
+
+
+
+
+@app.route('/genes/search', methods = ['GET'])
+def genes_search():
+    """/genes/search endpoint
+
+    This function returns the genes whose symbol, alias symbol, or previous
+    symbol starts with the q parameter, ignoring case, for type-ahead search.
+    The optional integer parameter limit, 20 by default, sets the maximum
+    number of genes returned.
+
+    Args:
+        None
+
+    Returns:
+        A list of dictionaries, each holding the hgnc_id and current symbol of
+        a matching gene, the term which matched, and its type, i.e. symbol,
+        alias_symbol, or prev_symbol. An exact symbol match comes first, then
+        other current symbols, then alias and previous symbols. If the
+        parameters are poorly formed, a descriptive string will be returned
+        with a 404 status code.
+    """
+    global search_limit
+    query = request.args.get('q', '')
+    if len(query) == 0:
+        return f'ERROR: parameter q is required', 404
+    try:
+        limit = int(request.args.get('limit', 20))
+        if limit < 1 or limit > search_limit:
+            raise ValueError()
+    except ValueError:
+        return f'ERROR: limit must be an integer from 1 to {search_limit}', 404
+    try:
+        return search_genes(query, limit)
+    except Exception as e:
+        print(f'ERROR: unable to search genes.\n{e}')
+        return f'ERROR: unable to search genes.', 500
+
+
+
+
+
+@app.route('/genes/by/<string:field>/<string:value>', methods = ['GET'])
+def genes_by_field_value(field: str, value: str):
+    """/genes/by/<string:field>/<string:value> endpoint
+
+    This function returns the genes with an external identifier, e.g. an
+    ensembl_gene_id, using the reverse lookup hash kept for each field in
+    IDENTIFIER_FIELDS. Values inside list fields, like uniprot_ids, are
+    found too. The optional comma-separated fields parameter limits the
+    result to the given attributes.
+
+    Args:
+        field: A string of the name of the identifier field.
+        value: A string of the identifier.
+
+    Returns:
+        A list of dictionaries holding the attributes of each gene with the
+        identifier, usually just one. If the field is not looked up or no gene
+        has the identifier, a descriptive string will be returned with a 404
+        status code.
+    """
+    global identifier_fields
+    if field not in identifier_fields:
+        return f'ERROR: {field} is not a lookup field', 404
+    try:
+        entry = get_reader().hget(f'lookup:{field}', value)
+        keys = sorted(entry.split('|')) if entry is not None else []
+        items = [item for item in lookup_genes(keys, get_fields_arg()) if item is not None]
+        if len(items) == 0:
+            return f'ERROR: No gene with {field} {value} found.', 404
+        return items
+    except Exception as e:
+        print(f'ERROR: unable to get genes.\n{e}')
+        return f'ERROR: unable to get genes.', 500
+
+
+
+
+
 @app.route('/genes/<string:hgnc_id>', methods = ['GET'])
 def genes_gene_id(hgnc_id: str):
     """/genes/<string:hgnc_id> endpoint
 
     This function returns all of the data for a gene specified by its hgnc_id.
-    Note that sparse attributes are excluded.
+    Note that sparse attributes are excluded. Recently requested genes are
+    served from an in-process LRU cache, which every replica clears whenever
+    any replica posts or deletes the data. The optional comma-separated fields
+    parameter limits the result to the given attributes.
 
     Args:
         hgnc_id: A string of the hgnc_id of the desired gene.
@@ -134,10 +2164,9 @@ def genes_gene_id(hgnc_id: str):
         A dictionary holding the attributes of a gene. Note that sparse
         attributes are excluded.
     """
-    global rd
     try:
-        item = rd.hgetall(hgnc_id)
-        if len(item) > 0:
+        item = lookup_genes([hgnc_id], get_fields_arg())[0]
+        if item is not None:
             return item
         else:
             return f'ERROR: Gene {hgnc_id} not found.', 404
@@ -149,65 +2178,93 @@ def genes_gene_id(hgnc_id: str):
 
 
 
+@app.route('/cache', methods = ['GET', 'DELETE'])
+def cache():
+    """/cache endpoint
+
+    This function either returns the statistics of this replica's gene cache,
+    or clears it, depending on if the HTTP request method is GET or DELETE,
+    respectively.
+
+    Args:
+        None
+
+    Returns:
+        If the method is GET, a dictionary holding the hit, miss, and
+            invalidation counters, the number of cached genes, and the cache
+            limits.
+        If the method is DELETE, a text message informing the user of success.
+    """
+    global gene_cache
+    if request.method == 'GET':
+        return gene_cache.stats()
+    elif request.method == 'DELETE':
+        gene_cache.clear()
+        return 'Cache successfully cleared', 200
+
+
+
+
+
 @app.route('/image', methods = ['POST', 'GET', 'DELETE'])
 def image():
     """/image endpoint
     
     This function either returns a plot image, generates the image, or clears
-    the image from memory, depending on if the HTTP request method is GET, POST,
-    or DELETE, respectively.
+    the images from memory, depending on if the HTTP request method is GET,
+    POST, or DELETE, respectively. The optional parameters attribute and kind
+    choose the aggregated attribute to plot, gene_group by default, and the
+    kind of chart, pie by default or bar.
 
     Args:
         None
 
     Returns:
-        If the method is GET, a PNG image. If there is an error, a descriptive
-            string will be returned with a 500 status code.
-        If the method is SET, a text message informing the user of success. If
-            there is an error, a descriptive string will be returned with a 500
-            status code.
+        If the method is GET, a PNG image, with an ETag derived from the image
+            bytes. The image is rendered and cached if the current dataset
+            version has no cached image for the attribute and kind. If the
+            request's If-None-Match header holds the ETag, an empty response
+            with a 304 status code is returned instead. If there is no data to
+            plot or the parameters are invalid, a descriptive string will be
+            returned with a 404 status code. If there is an error, a
+            descriptive string will be returned with a 500 status code.
+        If the method is SET, a text message informing the user of success.
+            The image is only rendered if it is not already cached. If there
+            is no data to plot or the parameters are invalid, a descriptive
+            string will be returned with a 404 status code. If there is an
+            error, a descriptive string will be returned with a 500 status
+            code.
         If the method is DELETE, a text message informing the user of success.
             If there is an error, a descriptive string will be returned with a
             500 status code.
     """
-    global rd, rd2
+    global rd2
+    if request.method in ('GET', 'POST'):
+        try:
+            attribute, kind = get_chart_args()
+        except ValueError as e:
+            return f'ERROR: {e}', 404
     if request.method == 'GET':
         try:
-            image_data = rd2.get('image')
+            key = chart_key(attribute, kind, get_version())
+            etag = rd2.hget(key, 'etag')
+            if etag is not None and etag.decode() in request.if_none_match:
+                return Response(status = 304, headers = {'ETag': f'"{etag.decode()}"'})
+            image_data = rd2.hget(key, 'png') if etag is not None else None
             if image_data is None:
-                return f'ERROR: Image not found.', 404
-            file_path = './temp_get.png'
-            with open(file_path, 'wb') as the_file:
-                the_file.write(image_data)
-            return send_file(file_path, mimetype = 'image/png', as_attachment = True)
+                chart = cache_chart(attribute, kind)
+                if chart is None:
+                    return f'ERROR: No data to plot.', 404
+                image_data = chart[0]
+            return send_file(io.BytesIO(image_data), mimetype = 'image/png', as_attachment = True, \
+                    download_name = f'{attribute}_{kind}.png', etag = hashlib.sha1(image_data).hexdigest(), conditional = True)
         except Exception as e:
             print(f'ERROR: unable to get image\n{e}')
             return f'ERROR: unable to get image', 500
     elif request.method == 'POST':
         try:
-            file_path = './temp_post.png'
-            the_labels = ['N/A']
-            values = [0]
-            for key in rd.keys():
-                gene_group = rd.hget(key, 'gene_group')
-                if gene_group is None:
-                    values[0] = values[0] + 1
-                elif gene_group in the_labels:
-                    values[the_labels.index(gene_group)] = values[the_labels.index(gene_group)] + 1
-                else:
-                    the_labels.append(gene_group)
-                    values.append(1)
-            # Remove trivial labels for legibility
-            s = sum(values)
-            for ii in range(0, len(values)):
-                if values[ii] / s < 0.03:
-                    the_labels[ii] = ''
-            fig, ax = plt.subplots()
-            ax.pie(values, labels = the_labels)
-            plt.title('Common Gene Groups')
-            plt.savefig(file_path)
-            image_data = open(file_path, 'rb').read()
-            rd2.set('image', image_data)
+            if not rd2.exists(chart_key(attribute, kind, get_version())) and cache_chart(attribute, kind) is None:
+                return f'ERROR: No data to plot.', 404
             return 'Image successfully posted', 200
         except Exception as e:
             print(f'ERROR: unable to post image\n{e}')
@@ -225,7 +2282,14 @@ def image():
 
 
 rd = get_redis_client(0, True)
+rd_raw = get_redis_client(0, False)
 rd2 = get_redis_client(1, False)
+rd3 = get_redis_client(2, True)
+rd_staging = get_redis_client(staging_db, True)
+replica_router = ReplicaRouter(replica_hosts, replica_max_lag, replica_check_interval)
+gene_cache = GeneCache(cache_size, cache_ttl)
+invalidation_thread = None
+invalidation_lock = threading.Lock()
 
 if __name__ == '__main__':
     app.run(host = '0.0.0.0', debug = True)
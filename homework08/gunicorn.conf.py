@@ -0,0 +1,32 @@
+# Settings for running genome_database under gunicorn in production, e.g.
+#     gunicorn -c gunicorn.conf.py genome_database:app
+import os
+import shutil
+import tempfile
+
+
+
+bind = f'0.0.0.0:{os.environ.get("PORT", 5000)}'
+workers = int(os.environ.get('WEB_WORKERS', 2)) # Processes, each with its own gene cache and Redis connection pools
+threads = int(os.environ.get('WEB_THREADS', 4)) # Requests each worker handles at once
+worker_class = 'gthread'
+timeout = 120 # Seconds a worker may stall before it is restarted, refreshes run in background threads
+accesslog = '-'
+
+# Workers are forked before importing the application, so every worker sets up
+# its own state, and the metrics of each are shared through files in this directory
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'gdb-metrics'))
+
+
+
+def on_starting(server):
+    """Empties the metrics directory, so counts do not carry over from a previous run."""
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors = True)
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'])
+
+
+
+def child_exit(server, worker):
+    """Drops the live gauges of a worker which has exited."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
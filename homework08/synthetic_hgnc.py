@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import argparse
+import gzip
+import json
+import random
+
+
+
+# Share of genes which have each optional attribute, roughly as in the HGNC complete set
+sparsity = {'alias_symbol': 0.45, 'alias_name': 0.2, 'prev_symbol': 0.3, 'prev_name': 0.35, 'gene_group': 0.55,
+        'ensembl_gene_id': 0.95, 'entrez_id': 0.97, 'refseq_accession': 0.9, 'uniprot_ids': 0.5, 'ccds_id': 0.45,
+        'omim_id': 0.4, 'mgd_id': 0.45, 'rgd_id': 0.45, 'vega_id': 0.6, 'ucsc_id': 0.7, 'ena': 0.6,
+        'pubmed_id': 0.7, 'rna_central_id': 0.2, 'mane_select': 0.45, 'cosmic': 0.45, 'lncipedia': 0.1}
+locus_types = [('protein-coding gene', 'gene with protein product', 0.45),
+        ('non-coding RNA', 'RNA, long non-coding', 0.13),
+        ('non-coding RNA', 'RNA, micro', 0.05),
+        ('pseudogene', 'pseudogene', 0.3),
+        ('other', 'unknown', 0.07)]
+chromosomes = [str(i) for i in range(1, 23)] + ['X', 'Y']
+
+
+
+def make_gene(i: int, rng: random.Random) -> dict:
+    """Makes a gene record shaped like those in the HGNC complete set.
+
+    Optional attributes are present with about the frequency they have in the
+    real data, and list attributes hold one or more elements.
+
+    Args:
+        i: An integer used to build the hgnc_id and other identifiers.
+        rng: A random.Random used to pick the attributes.
+
+    Returns:
+        A dictionary of the attributes of a gene, with list attributes as
+        lists, as in the source data.
+    """
+    locus_group, locus_type = rng.choices([(group, kind) for group, kind, weight in locus_types], \
+            weights = [weight for group, kind, weight in locus_types])[0]
+    chromosome = rng.choice(chromosomes)
+    arm = rng.choice('pq')
+    band = f'{rng.randint(11, 36)}.{rng.randint(1, 3)}'
+    item = {'hgnc_id': f'HGNC:{i}',
+            'symbol': f'SYN{i}',
+            'name': f'synthetic gene {i} {rng.choice(["family member", "subunit", "domain containing", "host gene"])}',
+            'status': rng.choices(['Approved', 'Entry Withdrawn'], weights = [0.97, 0.03])[0],
+            'locus_group': locus_group,
+            'locus_type': locus_type,
+            'location': f'{chromosome}{arm}{band}' if rng.random() < 0.99 else 'not on reference assembly',
+            'location_sortable': f'{chromosome.zfill(2)}{arm}{band}',
+            'date_approved_reserved': f'{rng.randint(1986, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'date_modified': f'{rng.randint(2010, 2023)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'agr': f'HGNC:{i}',
+            'uuid': f'{rng.getrandbits(128):032x}',
+            '_version_': rng.getrandbits(60)}
+    def present(attribute):
+        return rng.random() < sparsity[attribute]
+    if present('alias_symbol'):
+        item['alias_symbol'] = [f'SYN{i}A{j}' for j in range(rng.randint(1, 5))]
+    if present('alias_name'):
+        item['alias_name'] = [f'synthetic alias {i} {j}' for j in range(rng.randint(1, 3))]
+    if present('prev_symbol'):
+        item['prev_symbol'] = [f'SYN{i}P{j}' for j in range(rng.randint(1, 3))]
+    if present('prev_name'):
+        item['prev_name'] = [f'previous synthetic gene {i} name {j}' for j in range(rng.randint(1, 3))]
+    if present('gene_group'):
+        groups = rng.sample(range(1, 1500), rng.randint(1, 3))
+        item['gene_group'] = [f'Synthetic gene group {group}' for group in groups]
+        item['gene_group_id'] = groups
+    if present('ensembl_gene_id'):
+        item['ensembl_gene_id'] = f'ENSG{i:011d}'
+    if present('entrez_id'):
+        item['entrez_id'] = f'{100000 + i}'
+    if present('refseq_accession'):
+        item['refseq_accession'] = [f'{"NM" if locus_group == "protein-coding gene" else "NR"}_{rng.randint(1000, 999999):06d}']
+    if present('uniprot_ids'):
+        item['uniprot_ids'] = [f'{rng.choice("OPQ")}{rng.randint(10000, 99999)}' for j in range(rng.randint(1, 2))]
+    if present('ccds_id'):
+        item['ccds_id'] = [f'CCDS{rng.randint(1, 99999)}.1' for j in range(rng.randint(1, 4))]
+    if present('omim_id'):
+        item['omim_id'] = [f'{rng.randint(100000, 699999)}']
+    if present('mgd_id'):
+        item['mgd_id'] = [f'MGI:{rng.randint(1000000, 9999999)}']
+    if present('rgd_id'):
+        item['rgd_id'] = [f'RGD:{rng.randint(100000, 9999999)}']
+    if present('vega_id'):
+        item['vega_id'] = f'OTTHUMG{rng.randint(0, 999999):011d}'
+    if present('ucsc_id'):
+        item['ucsc_id'] = f'uc{rng.randint(1, 9):03d}{rng.choice("abcdefghij")}{rng.choice("abcdefghij")}{rng.choice("abcdefghij")}.{rng.randint(1, 5)}'
+    if present('ena'):
+        item['ena'] = [f'{rng.choice(["AB", "AF", "BC", "AK"])}{rng.randint(100000, 999999)}']
+    if present('pubmed_id'):
+        item['pubmed_id'] = [rng.randint(1000000, 37000000) for j in range(rng.randint(1, 6))]
+    if present('rna_central_id'):
+        item['rna_central_id'] = [f'URS0000{rng.getrandbits(36):09X}']
+    if present('mane_select'):
+        item['mane_select'] = [f'ENST{rng.randint(0, 999999):011d}.{rng.randint(1, 9)}', f'NM_{rng.randint(1000, 999999):06d}.{rng.randint(1, 9)}']
+    if present('cosmic'):
+        item['cosmic'] = item['symbol']
+    if present('lncipedia'):
+        item['lncipedia'] = item['symbol']
+    return item
+
+
+
+def generate_genes(n: int, seed: int = 332):
+    """Yields n synthetic gene records.
+
+    The same n and seed always yield the same records, so benchmarks run
+    against the same data each time.
+
+    Args:
+        n: An integer number of genes.
+        seed: An integer seed for the random choices.
+
+    Yields:
+        A dictionary of the attributes of a gene, as in the source data.
+    """
+    rng = random.Random(seed)
+    for i in range(1, n + 1):
+        yield make_gene(i, rng)
+
+
+
+def write_document(the_file, n: int, seed: int = 332) -> None:
+    """Writes n synthetic genes as an HGNC complete set JSON document.
+
+    Genes are written one at a time, so documents of any size can be made
+    without holding them in memory.
+
+    Args:
+        the_file: A writable text file object.
+        n: An integer number of genes.
+        seed: An integer seed for the random choices.
+
+    Returns:
+        None
+    """
+    the_file.write('{"responseHeader":{"status":0,"QTime":0},"response":{"numFound":' + str(n) + ',"start":0,"docs":[')
+    for ii, item in enumerate(generate_genes(n, seed)):
+        if ii > 0:
+            the_file.write(',')
+        the_file.write(json.dumps(item))
+    the_file.write(']}}')
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Write a synthetic HGNC complete set JSON document.')
+    parser.add_argument('genes', type = int, help = 'number of genes')
+    parser.add_argument('path', help = 'output file, gzip-compressed if it ends with .gz')
+    parser.add_argument('--seed', type = int, default = 332, help = 'random seed')
+    args = parser.parse_args()
+    opener = gzip.open if args.path.endswith('.gz') else open # A .gz path makes a snapshot for offline mode
+    with opener(args.path, 'wt') as the_file:
+        write_document(the_file, args.genes, args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+
+
+import gzip
+import os
+os.environ.setdefault('REDIS_IP', '127.0.0.1') # Clients connect lazily, so no server is needed
+import genome_database
+from genome_database import parse_location, band_range, refresh_data, lookup_genes
+from synthetic_hgnc import write_document
+import pytest
+
+
+
+def within(location, band_from, band_to):
+    low = band_range(band_from)[0]
+    high = band_range(band_to)[1]
+    return low <= parse_location(location)[2] <= high
+
+
+
+def test_parse_location():
+    assert parse_location(None) == None
+    assert parse_location('reserved') == None
+    assert parse_location('not on reference assembly') == None
+    assert parse_location('mitochondria') == ('MT', '', 0.0)
+    assert parse_location('17q21.31') == ('17', 'q', parse_location('17q21.31')[2])
+    assert parse_location('1p36.33-p36.32')[:2] == ('1', 'p')
+    assert parse_location('Xp22.33 and Yp11.2')[:2] == ('X', 'p')
+    assert parse_location('17q') == ('17', 'q', 1.0)
+    assert parse_location('17p') == ('17', 'p', -1.0)
+    assert parse_location('17cen') == ('17', '', 0.0)
+    assert parse_location('10 alternate reference locus') == ('10', '', 0.0)
+    # Positions sort from the end of the p arm to the end of the q arm
+    order = ['1p36.33', '1p36.1', '1p22', '1p13.2', '1p', '1cen', '1q', '1q12', '1q21.1', '1q21.3', '1q3', '1q44']
+    positions = [parse_location(location)[2] for location in order]
+    assert positions == sorted(positions)
+    assert len(set(positions)) == len(positions)
+
+
+
+def test_band_range():
+    with pytest.raises(ValueError):
+        band_range('21')
+    with pytest.raises(ValueError):
+        band_range('cen')
+    with pytest.raises(ValueError):
+        band_range('q21.')
+    low, high = band_range('q21')
+    assert low < high
+    # A region covers its bands, and a band covers its sub-bands
+    assert within('17q21', 'q2', 'q2')
+    assert within('17q29.9', 'q2', 'q2')
+    assert within('17q21.33', 'q21', 'q21')
+    assert within('17q21.3', 'q21.3', 'q21.3')
+    assert not within('17q3', 'q2', 'q2')
+    assert not within('17q22', 'q21', 'q21')
+    assert not within('17q21.4', 'q21.3', 'q21.3')
+    assert within('17q24', 'q2', 'q3')
+    assert within('17p13.2', 'p13', 'p13')
+    assert within('17p13.2', 'p2', 'p1')
+    assert not within('17p21', 'p13', 'p13')
+    # An arm covers genes located only by the arm, and no others
+    assert within('17q', 'q', 'q')
+    assert within('17q25.3', 'q', 'q')
+    assert not within('17q', 'q2', 'q3')
+    assert not within('17q', 'p', 'p')
+    assert not within('17p', 'q', 'q')
+    assert not within('17cen', 'p', 'p')
+    assert not within('17cen', 'q', 'q')
+    assert within('17cen', 'p', 'q')
+
+
+
+def test_refresh_from_snapshot(tmp_path, monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    for name, db, decode in [('rd', 0, True), ('rd_raw', 0, False), ('rd2', 1, False), ('rd3', 2, True), \
+            ('rd_staging', genome_database.staging_db, True)]:
+        monkeypatch.setattr(genome_database, name, fakeredis.FakeRedis(server = server, db = db, decode_responses = decode))
+    path = tmp_path / 'hgnc_complete_set.json.gz'
+    monkeypatch.setattr(genome_database, 'snapshot_path', str(path))
+    pubsub = genome_database.rd.pubsub(ignore_subscribe_messages = True)
+    pubsub.subscribe(genome_database.invalidation_channel)
+    pubsub.get_message(timeout = 1) # The subscription confirmation
+    with gzip.open(path, 'wt') as the_file:
+        write_document(the_file, 200)
+    stats = refresh_data(source = 'snapshot')
+    assert (stats['genes'], stats['added'], stats['version']) == (200, 200, 1)
+    assert lookup_genes(['HGNC:1'])[0]['symbol'] == 'SYN1'
+    assert pubsub.get_message(timeout = 1)['data'] == '1'
+    # Nothing changed, so no new version is swapped in
+    stats = refresh_data(source = 'snapshot')
+    assert (stats['unchanged'], stats['version']) == (200, 1)
+    assert pubsub.get_message(timeout = 0.1) is None
+    # A removed gene is dropped incrementally
+    with gzip.open(path, 'wt') as the_file:
+        write_document(the_file, 199)
+    stats = refresh_data(source = 'snapshot')
+    assert (stats['removed'], stats['unchanged'], stats['version']) == (1, 199, 2)
+    assert lookup_genes(['HGNC:199', 'HGNC:200'])[1] is None
+    assert pubsub.get_message(timeout = 1)['data'] == '2'
+    assert genome_database.gene_cache.version == 2